@@ -2,64 +2,156 @@
 # specifically for gene sequences (i.e. list of nucleotides)
 # probabilities calculated using conditional probabilities and MLE approximations
 
-import pandas as pd
+import hashlib
+import json
+import os
 import numpy as np
-import re
-from collections import Counter
 from ORF import ORF, read_fna
+from encoding import digest, encode, encode_many, prefix_codes, rolling_codes
+from kmers import KmerCounts, SparseKmerCounts, SparseTable, count_kmer_pair, count_sequences, count_starts, ranges_table_class
 from math import log
+from profiling import stage
+from score_cache import SCORE_CACHE
 
 nucleotides = list("ACGT")
 
+# names of the count tables a model is trained into, in the order they're saved
+COUNT_TABLES = ["kmer_counts", "kponemer_counts", "start_counts", "bg_kmer_counts", "bg_kponemer_counts", "bg_start_counts"]
+LOG_TABLES = ["log_p_start", "log_p", "log_q_start", "log_q"]
+
 class MarkovModel:
-    def __init__(self, k, pseudocount, seq, long_len=1400, short_len=50):
-        self.seq = seq
+    def __init__(self, k, pseudocount, seq, long_len=1400, short_len=50, both_strands=False):
         self.k = k
         self.pseudocount = pseudocount
+        self.long_len = long_len
+        self.short_len = short_len
+        self.both_strands = both_strands
 
-        # orfs: parse given seq into ORF data structure
-        self.orfs = ORF(seq, long_len, short_len)
+        # orfs: parse given seq into ORF data structure, on the forward strand or on both strands
+        self.set_genome(seq)
+        self.genome_digest = digest(self.orfs.codes)
 
-        # long orf counts - count kmers, k+1mer (similar to ngrams but with nucleotides, i.e. example of 3-mer: ATG) for MLE approximations of Markov probabilities
-        self.kmer_counts = self.count_kmers(self.k, self.orfs.long_orfs)
-        self.kponemer_counts = self.count_kmers(self.k+1, self.orfs.long_orfs)
-        self.start_counts = self.count_starts(self.orfs.long_orfs)
+        with stage("count") as profile:
+            # long orf counts - count kmers, k+1mer (similar to ngrams but with nucleotides, i.e. example of 3-mer: ATG) for MLE approximations of Markov probabilities
+            long_codes, long_starts, long_ends = self.orfs.long_ranges()
+            # one backend for all tables: the background ranges are as long as the long orf ranges
+            table = ranges_table_class(self.k, long_starts, long_ends)
+            self.kmer_counts, self.kponemer_counts = count_kmer_pair(long_codes, long_starts, long_ends, self.k, table)
+            self.start_counts = count_starts(long_codes, long_starts, long_ends, self.k, table)
 
-        # background sequences counts - process counts similarly, but for "background" orfs. We define background orfs to be reverse complement of a given sequence.
-        self.bg_kmer_counts = self.count_kmers(self.k, self.orfs.background)
-        self.bg_kponemer_counts = self.count_kmers(self.k+1, self.orfs.background)
-        self.bg_start_counts = self.count_starts(self.orfs.background)
+            # background sequences counts - process counts similarly, but for "background" orfs. We define background orfs to be reverse complement of a given sequence.
+            bg_codes, bg_starts, bg_ends = self.orfs.background_ranges()
+            self.bg_kmer_counts, self.bg_kponemer_counts = count_kmer_pair(bg_codes, bg_starts, bg_ends, self.k, table)
+            self.bg_start_counts = count_starts(bg_codes, bg_starts, bg_ends, self.k, table)
+            profile.count(orfs=len(long_starts), kmers=self.kponemer_counts.total() + self.bg_kponemer_counts.total())
 
+        # log probability tables, computed once so scoring is a lookup
+        self.build_tables()
 
+    @classmethod
+    def from_counts(cls, k, pseudocount, counts, seq=None, long_len=1400, short_len=50, genome_digest=None, both_strands=False):
+        """
+        build a model from already counted tables instead of training it on a genome
+        --
+        input: counts -> dict of KmerCounts keyed by COUNT_TABLES names, seq to score (optional) -> str or np.ndarray
+        output: model -> MarkovModel
+        """
+        mm = cls.__new__(cls)
+        mm.k = k
+        mm.pseudocount = pseudocount
+        mm.long_len = long_len
+        mm.short_len = short_len
+        mm.both_strands = both_strands
+        mm.genome_digest = genome_digest
+        for name in COUNT_TABLES:
+            setattr(mm, name, counts[name])
+        mm.set_genome(seq)
+        mm.build_tables()
+        return mm
 
-    def generate_kmers(self, seq, k):
-        """ generate list of kmers given a sequence """
-        kmers = [seq[i-k:i] for i in range(k,len(seq)+1)]
-        return kmers
+    def set_genome(self, seq):
+        """
+        set the genome that results() scores, the model itself doesn't depend on it. seq can also be an already parsed ORF
+        """
+        self.seq = seq
+        self._genome_cumulative = None
+        if seq is None:
+            self.orfs = None
+        elif isinstance(seq, ORF):
+            self.orfs = seq
+        else:
+            self.orfs = ORF(seq, self.long_len, self.short_len, self.both_strands)
 
-    def count_kmers(self, k, seq):
-        """ return a Counter object of kmer counts given a sequence """
-        total_kmers = []
-        for x in seq:
-            total_kmers += self.generate_kmers(x,k)
+    @property
+    def codes(self):
+        """ the buffer the orfs point into, which starts with the genome itself """
+        return None if self.orfs is None else self.orfs.buffer
+
+    def save(self, filename):
+        """ save the trained model, i.e. its count tables, log probability tables and parameters, as a .npz file """
+        metadata = {"k": self.k, "pseudocount": self.pseudocount, "long_len": self.long_len, "short_len": self.short_len,
+                    "both_strands": self.both_strands, "genome_digest": self.genome_digest, "sparse": self.sparse}
+        arrays = {name: getattr(self, name).counts for name in COUNT_TABLES}
+        if self.sparse:
+            # sparse log tables are rebuilt from the counts on load
+            # every table is saved sparse, even one counted dense (i.e. merged or built from other counts)
+            arrays.update({name: getattr(self, name).sparse().counts for name in COUNT_TABLES})
+            arrays.update({name + "_codes": getattr(self, name).sparse().codes for name in COUNT_TABLES})
+        else:
+            arrays.update({name: getattr(self, name) for name in LOG_TABLES})
+        np.savez_compressed(filename, metadata=json.dumps(metadata), **arrays)
 
-        return Counter(total_kmers)
+    @classmethod
+    def load(cls, filename, seq=None, short_len=None):
+        """ load a model saved with save(), optionally setting the genome to score. the training genome is not needed """
+        with np.load(filename) as f:
+            metadata = json.loads(str(f["metadata"]))
+            k = metadata["k"]
+            if metadata.get("sparse", False):
+                counts = {name: SparseKmerCounts(k+1 if "kponemer" in name else k, f[name + "_codes"], f[name]) for name in COUNT_TABLES}
+                tables = None
+            else:
+                counts = {name: KmerCounts(k+1 if "kponemer" in name else k, f[name]) for name in COUNT_TABLES}
+                tables = {name: f[name] for name in LOG_TABLES}
+
+        mm = cls.__new__(cls)
+        mm.k = k
+        mm.pseudocount = metadata["pseudocount"]
+        mm.long_len = metadata["long_len"]
+        mm.short_len = metadata["short_len"] if short_len is None else short_len
+        mm.both_strands = metadata.get("both_strands", False)
+        mm.genome_digest = metadata["genome_digest"]
+        for name in COUNT_TABLES:
+            setattr(mm, name, counts[name])
+        if tables is None:
+            mm.build_tables()
+        else:
+            for name in LOG_TABLES:
+                setattr(mm, name, tables[name])
+            mm.log_ratio_start = mm.log_p_start - mm.log_q_start
+            mm.log_ratio = mm.log_p - mm.log_q
+        mm.set_genome(seq)
+        return mm
+
+    def count_kmers(self, k, seq):
+        """ return a KmerCounts table of kmer counts given a list of sequences """
+        kmer_counts, _ = count_sequences(seq, k)
+        return kmer_counts
 
     def count_starts(self, seqs):
         """ count the starting kmers, i.e. the beginning of sequence """
-        starts = []
-        for x in seqs:
-            starts.append(x[0:self.k])
-        return Counter(starts)
+        return count_starts(*encode_many(seqs), self.k)
 
     def print_count(self, counts):
         """ this prints a quick report summarizing nucleotide counts as a sanity check """
+        import pandas as pd
+
         df = pd.DataFrame(columns=nucleotides, index=nucleotides)
 
         for x in nucleotides:
             for y in nucleotides:
                 key = "AAG"+x+y+"T"
-                df[y][x] = counts[key]
+                df.loc[x, y] = counts[key]
         
         return str(df)
 
@@ -70,57 +162,216 @@ class MarkovModel:
             "Q count(AAGxyT): " + "\n" + self.print_count(self.bg_kponemer_counts) 
 
     # initialize probability, MLE approximation assumptions described in equation (1), page 2 of pdf
-    def calculate_start_proba(self, start_counts, token, V):
-        """ MLE approximation of starting kmer probabilities, i.e. probabilities from counts of starting kmers only """
-        norm = sum(start_counts.values())
-        if token not in start_counts:
-            return log(self.pseudocount/(self.pseudocount*V))
-        else:
-            return log((start_counts[token] + self.pseudocount)/(norm + self.pseudocount*V))
+    def start_log_proba(self, start_counts, V):
+        """
+        MLE approximation of starting kmer probabilities, i.e. probabilities from counts of starting kmers only
+        --
+        output: log probability of every starting kmer, indexed by kmer code. the extra last entry (code -1) is used for
+                kmers that can't be coded, i.e. starts shorter than k -> np.ndarray of length 4^k + 1
+        """
+        norm = start_counts.total()
+        unseen = log(self.pseudocount/(self.pseudocount*V))
+        if self.sparse:
+            start_counts = start_counts.sparse()
+            with np.errstate(divide="ignore"):
+                values = np.log((start_counts.counts + self.pseudocount)/(norm + self.pseudocount*V))
+            return SparseTable(start_counts.codes, values, unseen)
+
+        start_counts = start_counts.dense()
+        with np.errstate(divide="ignore"):
+            table = np.where(start_counts.counts > 0, np.log((start_counts.counts + self.pseudocount)/(norm + self.pseudocount*V)), unseen)
+        return np.append(table, unseen)
 
     # MLE approximated conditional probability and markov model probability calculation, page 2 of pdf
-    def conditional_proba(self, token, kponemer_counts, kmer_counts, V):
-        """ MLE approximation of kmer probabilities, i.e. probabilities from counts of kmers """
-        if token[:-1] not in kmer_counts and token not in kponemer_counts:
-            return log(self.pseudocount / (self.pseudocount*V))
-        elif token[:-1] in kmer_counts and token not in kponemer_counts:
-            return log(self.pseudocount / (kmer_counts[token[:-1]] + self.pseudocount*V))
-        return log( (kponemer_counts[token] + self.pseudocount) / (kmer_counts[token[:-1]] + self.pseudocount*V) )
-
-    def sequence_proba(self, seq, start_counts, kponemer_counts, kmer_counts):
+    def conditional_log_proba(self, kponemer_counts, kmer_counts, V):
+        """
+        MLE approximation of kmer probabilities, i.e. probabilities from counts of kmers.
+        an unseen k+1mer gets pseudocount / (kmer count + pseudocount*V), which reduces to 1/V when its kmer is unseen too
+        --
+        output: log probability of every k+1mer given its first k bases, indexed by k+1mer code. the extra last entry (code -1)
+                is used for k+1mers covering a non ACGT base -> np.ndarray of length 4^(k+1) + 1.
+                for a sparse model, the observed k+1mers backing off to the unseen probability of their kmer -> SparseTable
+        """
+        if self.sparse:
+            kponemer_counts, kmer_counts = kponemer_counts.sparse(), kmer_counts.sparse()
+            with np.errstate(divide="ignore"):
+                values = np.log((kponemer_counts.counts + self.pseudocount) / (kmer_counts.lookup(kponemer_counts.codes >> 2) + self.pseudocount*V))
+                unseen = np.log(self.pseudocount / (kmer_counts.counts + self.pseudocount*V))
+            default = log(self.pseudocount/(self.pseudocount*V))
+            return SparseTable(kponemer_counts.codes, values, default, SparseTable(kmer_counts.codes, unseen, default))
+
+        kponemer_counts, kmer_counts = kponemer_counts.dense(), kmer_counts.dense()
+        kmers = np.arange(4**(self.k+1)) >> 2
+        with np.errstate(divide="ignore"):
+            table = np.log((kponemer_counts.counts + self.pseudocount) / (kmer_counts.counts[kmers] + self.pseudocount*V))
+        return np.append(table, log(self.pseudocount/(self.pseudocount*V)))
+
+    @property
+    def sparse(self):
+        """ whether the model keeps sparse tables (see kmers.table_class), i.e. it was trained at a large k """
+        return any(isinstance(getattr(self, name), SparseKmerCounts) for name in COUNT_TABLES)
+
+    def build_tables(self):
+        """ precompute log probability tables of P and Q, and their log likelihood ratio tables used for scoring """
+        with stage("tables"):
+            V = len(self.kmer_counts)
+            self.log_p_start = self.start_log_proba(self.start_counts, V)
+            self.log_p = self.conditional_log_proba(self.kponemer_counts, self.kmer_counts, V)
+
+            V = len(self.bg_kmer_counts)
+            self.log_q_start = self.start_log_proba(self.bg_start_counts, V)
+            self.log_q = self.conditional_log_proba(self.bg_kponemer_counts, self.bg_kmer_counts, V)
+
+            self.log_ratio_start = self.log_p_start - self.log_q_start
+            self.log_ratio = self.log_p - self.log_q
+
+    def position_scores(self, codes, table=None):
+        """ score of the k+1mer starting at each position of an encoded buffer, defaults to the log likelihood ratio table """
+        if table is None:
+            table = self.log_ratio
+        return table[rolling_codes(codes, self.k+1)]
+
+    def prefix_sums(self, codes, table=None):
+        """ cumulative sums of the position scores, i.e. prefix_sums[i] = sum of the scores of k+1mers starting before i """
+        return np.concatenate(([0.0], np.cumsum(self.position_scores(codes, table))))
+
+    def score_ranges(self, codes, starts, ends, start_table=None, table=None, cumulative=None):
+        """
+        score every [start, end) range of an encoded buffer at once, as a difference of two prefix sums plus the start term.
+        defaults to the log likelihood ratio tables
+        --
+        input: base codes -> np.ndarray, range offsets -> np.ndarray, np.ndarray, optional precomputed prefix sums -> np.ndarray
+        output: log probability (or log likelihood ratio) of each range -> np.ndarray
+        """
+        with stage("score", orfs=len(starts)) as profile:
+            if start_table is None:
+                start_table, table = self.log_ratio_start, self.log_ratio
+            if cumulative is None:
+                cumulative = self.prefix_sums(codes, table)
+                profile.count(bases=len(codes))
+            starts = np.asarray(starts, dtype=np.int64)
+            ends = np.asarray(ends, dtype=np.int64)
+
+            # like the first kmer, the first k+1mer of a sequence is covered by the start probability,
+            # so the k+1mers of a range start at start+1 and the last one starts at end-k-1
+            first = np.minimum(starts + 1, len(cumulative) - 1)
+            last = np.clip(ends - self.k, first, len(cumulative) - 1)
+            return start_table[prefix_codes(codes, starts, ends, self.k)] + cumulative[last] - cumulative[first]
+
+    def genome_prefix_sums(self):
+        """ prefix sums of the log likelihood ratio over the whole genome, computed once and shared by all ORF sets """
+        if self._genome_cumulative is None:
+            with stage("genome_scores", bases=len(self.codes)):
+                self._genome_cumulative = self.prefix_sums(self.codes)
+        return self._genome_cumulative
+
+    def score_locations(self, locations):
+        """ score ORFs given as (start, end) genome locations, in O(1) each from the genome prefix sums """
+        locations = np.asarray(locations, dtype=np.int64).reshape(-1, 2)
+        return self.score_ranges(self.codes, locations[:, 0], locations[:, 1], cumulative=self.genome_prefix_sums())
+
+    def fingerprint(self):
+        """ hash of everything the model's scores depend on: k, pseudocount and the count tables (not short_len) """
+        h = hashlib.sha256(json.dumps({"k": int(self.k), "pseudocount": float(self.pseudocount)}).encode())
+        for name in COUNT_TABLES:
+            table = getattr(self, name)
+            for array in (getattr(table, "codes", None), table.counts):
+                if array is not None:
+                    h.update(np.ascontiguousarray(array, dtype=np.int64).data)
+        return h.hexdigest()
+
+    def orf_scores(self, processes=1, cache=SCORE_CACHE):
+        """
+        score of every ORF of the genome from the genome prefix sums, or in a process pool with more than one process.
+        memoized in the score cache (see score_cache.py), pass cache=None to always rescore
+        """
+        def compute():
+            if (processes or os.cpu_count()) > 1:
+                from parallel import score_orfs
+                return score_orfs(self, self.orfs, processes)
+            return self.score_ranges(*self.orfs.buffer_ranges(), cumulative=self.genome_prefix_sums())
+
+        if cache is None:
+            return compute()
+        return cache.scores(self, self.orfs.codes, self.orfs.starts, self.orfs.ends, compute, self.orfs.strands)
+
+    def write_bedgraph(self, filename, chrom, window=100):
+        """ write the mean log likelihood ratio of each k+1mer over non-overlapping windows of the genome as a bedGraph track """
+        cumulative = self.genome_prefix_sums()
+        n = len(self.orfs.codes) - self.k
+        bounds = np.append(np.arange(0, n, window), n)
+        means = np.diff(cumulative[bounds]) / np.diff(bounds)
+
+        with open(filename, "w") as f:
+            for start, end, value in zip(bounds[:-1], bounds[1:], means):
+                f.write("{}\t{}\t{}\t{:.6g}\n".format(chrom, start, end, value))
+
+    def sequence_proba(self, seq, start_table, table):
         """ 
         calculate the probability based on counts using MLE approximation
         --
-        input: starting kmer counts -> Counter, k+1mer counts -> Counter, kmer counts -> Counter
+        input: sequence -> str, starting kmer log probabilities -> np.ndarray, k+1mer log probabilities -> np.ndarray
         output: log probability of a given sequence -> float
         """
-        
-        V = len(kmer_counts.keys())
-        logprob = self.calculate_start_proba(start_counts , seq[0:self.k], V)
-        
-        for i in range(self.k+2,len(seq)+1):
-            logprob += self.conditional_proba(seq[i-self.k-1:i],kponemer_counts, kmer_counts, V)
-        return logprob
+        codes = encode(seq)
+        logprob = start_table[prefix_codes(codes, [0], [len(codes)], self.k)[0]]
+        return float(logprob + table[rolling_codes(codes, self.k+1)[1:]].sum())
         
     # score by log likelihood: 
     #   P score = ORF scored by markov probability
     #   Q score = reverse complement of ORF scored by markov probability
+    # both are computed at once from the precomputed log likelihood ratio tables
     def score(self, seq):
         """ score the sequence based on markov probability """
-        P_score = self.sequence_proba(seq, self.start_counts, self.kponemer_counts, self.kmer_counts)
-        Q_score = self.sequence_proba(seq, self.bg_start_counts, self.bg_kponemer_counts, self.bg_kmer_counts)
-        return P_score - Q_score # since they're log probabilities, we subtract
+        return self.sequence_proba(seq, self.log_ratio_start, self.log_ratio)
+
+    def score_many(self, seqs):
+        """ score a list of sequences in one vectorized pass """
+        return self.score_ranges(*encode_many(seqs))
 
+    def results(self, whole_genome=True, processes=1, cache=SCORE_CACHE):
+        """
+        format resulting probabilities into a list; start position of ORF, end position of ORF, length of ORF, markov score of ORF.
+        with whole_genome, every ORF is scored from the genome prefix sums instead of from its own substring, and the scores
+        are memoized in cache (see orf_scores, None always rescores). with more than one process (None = all cores), ORFs are scored in a process pool
+        sharing the genome (see parallel.py)
+        """
+        if whole_genome or (processes or os.cpu_count()) > 1:
+            scores = self.orf_scores(processes, cache)
+        else:
+            scores = self.score_many(self.orfs.total_orfs)
 
-    def results(self):
-        """ format resulting probabilities into a list; start position of ORF, end position of ORF, length of ORF, markov score of ORF """
         results = []
-        for seq, loc in zip(self.orfs.total_orfs, self.orfs.all_orf_locations):
-            results.append({ "start" : loc[0], "end" : loc[1], "length" : len(seq), "score" : self.score(seq)})
+        strands = np.where(self.orfs.strands > 0, "+", "-")
+        for start, end, length, strand, score in zip(self.orfs.starts, self.orfs.ends, self.orfs.lengths, strands, scores):
+            results.append({ "start" : start, "end" : end, "length" : length, "strand" : strand, "score" : score})
 
         return results
 
+# trained model cache: models are saved under a key derived from the training genome's content and the
+# parameters that affect training (short_len only matters for reporting, so it's not part of the key)
+def model_key(k, pseudocount, long_len, genome_digest, both_strands=False):
+    # pseudocount 1 and 1.0 (i.e. the default and -pseudo 1) are the same model
+    params = {"k": int(k), "pseudocount": float(pseudocount), "long_len": int(long_len), "genome": genome_digest}
+    if both_strands:
+        params["both_strands"] = True
+    params = json.dumps(params, sort_keys=True)
+    return hashlib.sha256(params.encode()).hexdigest()[:16]
+
+def cached_model(k, pseudocount, seq, long_len=1400, short_len=50, cache_dir="models", both_strands=False):
+    """ load a trained model from the cache directory if this genome and parameters were trained before, otherwise train and save it """
+    filename = os.path.join(cache_dir, "mm_{}.npz".format(model_key(k, pseudocount, long_len, digest(encode(seq)), both_strands)))
+    if os.path.exists(filename):
+        return MarkovModel.load(filename, seq, short_len)
+
+    mm = MarkovModel(k, pseudocount, seq, long_len, short_len, both_strands)
+    os.makedirs(cache_dir, exist_ok=True)
+    mm.save(filename)
+    return mm
+
 def main():
+    import pandas as pd
+
     # golden set (our dev set)
     goldens = pd.read_csv("data/plusgenes-subset.gff", delimiter="\t", header=None)
 
@@ -1,55 +1,25 @@
 # ORF class for
 # processing gene sequence data into long and short ORFs
 
-import pandas as pd
 import numpy as np
-import re
-from collections import Counter
+from encoding import decode, encode, kmer_code, reverse_complement, rolling_codes
+from fasta import GenomeData, read_fna
+from profiling import stage
 
 STOP_CODON = ["TAA","TAG","TGA"]
+STOP_CODES = [kmer_code(x) for x in STOP_CODON]
 COMPLEMENTS = {"A":"T","T":"A","C":"G","G":"C"}
-
-# organize input data into a class
-class GenomeData:
-    def __init__(self):
-        self.seq_name = None
-        self.sequence = ""
-        self.seq_len = 0
-
-def read_fna(filename):
-    f = open(filename, "r")
-    lines = f.readlines()
-    f.close()
-
-    input_data = []
-
-    for l in lines:
-        if l[0] == ">":
-            try:
-                g.seq_len = len(g.sequence)
-                input_data.append(g)
-            except:
-                pass
-            g = GenomeData()
-            g.seq_name = l.strip()
-        else:
-            g.sequence = g.sequence + re.sub(r"((?:(?!A|C|T|G)\S))","T",l.strip().upper())
-
-    g.seq_len = len(g.sequence)
-    input_data.append(g)
-
-    return input_data
+COMPLEMENT_TABLE = str.maketrans(COMPLEMENTS)
 
 # find stop codons
-def find_stops(seq):
-    stop_locations = []
+def find_all_stops(codes):
+    """ positions of every stop codon in all three reading frames, in a single pass over the encoded sequence """
+    return np.flatnonzero(np.isin(rolling_codes(codes, 3), STOP_CODES))
 
-    for i in range(3,len(seq)+1,3):
-        window = seq[i-3:i]
-        
-        if window in STOP_CODON:
-            stop_locations.append(i)
-    return np.array(stop_locations)
+def find_stops(seq):
+    """ end positions of the stop codons in the reading frame starting at index 0 """
+    stop_locations = find_all_stops(encode(seq))
+    return stop_locations[stop_locations % 3 == 0] + 3
 
 # calculate orf locations
 def orf_locations(seq, stop_locations, start_reading):
@@ -59,55 +29,259 @@ def orf_locations(seq, stop_locations, start_reading):
     stop_idxs = np.append(stop_idxs, [len(seq)])
     return list(zip(start_idxs, stop_idxs))
 
+def orf_index(codes):
+    """
+    ORFs of all three reading frames, segmented at stop codons
+    --
+    input: base codes of the genome -> np.ndarray
+    output: start, end offsets of each ORF (stop codon excluded) and its reading frame -> np.ndarray, np.ndarray, np.ndarray (int64)
+    """
+    stops = find_all_stops(codes)
+    starts, ends, frames = [], [], []
+
+    for frame in range(3):
+        stop_locations = stops[stops % 3 == frame]
+        # an ORF runs from the frame start (or the previous stop) to the next stop (or the end of the sequence)
+        frame_starts = np.insert(stop_locations + 3, 0, frame)
+        frame_ends = np.append(stop_locations, len(codes))
+        keep = frame_ends - frame_starts > 0
+        starts.append(frame_starts[keep])
+        ends.append(frame_ends[keep])
+        frames.append(np.full(np.count_nonzero(keep), frame))
+
+    return np.concatenate(starts).astype(np.int64), np.concatenate(ends).astype(np.int64), np.concatenate(frames).astype(np.int64)
+
 # orf sequences
 def orf_seqs(seq, start_reading):
-    stop_locations = find_stops(seq[start_reading:])
-    orf_idxs = orf_locations(seq, stop_locations, start_reading)
-    return [(i,j) for i, j in orf_idxs if j-i > 0], [seq[i:j] for i, j in orf_idxs if j-i > 0]
+    starts, ends, frames = orf_index(encode(seq))
+    in_frame = frames == start_reading
+    orf_idxs = list(zip(starts[in_frame], ends[in_frame]))
+    return orf_idxs, [seq[i:j] for i, j in orf_idxs]
+
+
+class OrfSequences:
+    """
+    list of ORF sequences as [start, end) offsets into one shared encoded buffer.
+    view() gives a zero-copy numpy slice of the base codes, indexing materializes the substring only when asked for
+    """
+    __slots__ = ("codes", "starts", "ends")
+
+    def __init__(self, codes, starts, ends):
+        self.codes = codes
+        self.starts = starts
+        self.ends = ends
+
+    def __len__(self):
+        return len(self.starts)
+
+    def view(self, i):
+        return self.codes[self.starts[i]:self.ends[i]]
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return OrfSequences(self.codes, self.starts[i], self.ends[i])
+        return decode(self.view(i))
+
+    def __iter__(self):
+        for i, j in zip(self.starts, self.ends):
+            yield decode(self.codes[i:j])
+
+    def __add__(self, other):
+        return list(self) + list(other)
 
 
 # for background ORF calculation, we used reverse complement of the nucleotides
 # i.e. TAAGC -> reverse complement of ATTCG
 # nucleotide complement pattern specified as COMPLEMENTS
 def background_seqs(trusted_orfs):
+    return [x[::-1].translate(COMPLEMENT_TABLE) for x in trusted_orfs]
 
-    background = []
-    for x in trusted_orfs:
-        reversed_orf = x[::-1]
-        reverse_complements = ""
-        for y in reversed_orf:
-            reverse_complements += COMPLEMENTS[y]
-
-        background.append(reverse_complements)
-        
-    return background
+def strand_buffer(codes):
+    """ both strands of an encoded genome in one buffer: the forward strand followed by its reverse complement """
+    buffer = np.empty(2*len(codes), dtype=np.uint8)
+    buffer[:len(codes)] = codes
+    buffer[len(codes):] = reverse_complement(codes)
+    return buffer
 
+# memory layout: the genome is held once as one uint8 base code per base, every ORF is 18 bytes of index
+# (int64 start, int64 end, int8 frame, int8 strand) and long/short selections are int64 index arrays into it.
+# minus strand orfs and background orfs (reverse complements of long orfs) need the reverse strand, which is built once
+# on first use into a buffer holding both strands (2 bytes per base), and codes becomes a view of its first half, so the
+# genome still isn't held twice. orfs of either strand are then just ranges of it:
+# a forward orf [start, end) is buffer[start:end], a minus strand orf is buffer[2L-end:2L-start], and the reverse
+# complement of any range [i, j) of the buffer is its mirror image [2L-j, 2L-i).
 class ORF:
-    def __init__(self, seq, long_len=1400, short_len=50):
-        self.seq = seq
+    __slots__ = ("codes", "long_len", "short_len", "starts", "ends", "frames", "strands", "long_idxs", "short_idxs", "_strand_buffer")
+
+    def __init__(self, seq, long_len=1400, short_len=50, both_strands=False):
         self.long_len = long_len
         self.short_len = short_len
 
+        with stage("orf") as profile:
+            # orf index: start, end offsets (forward strand coordinates), reading frame (0, 1 or 2) and strand (1 or -1) of every orf,
+            # frame by frame. seq can be a string or an already encoded array, which is used as is
+            self.codes = encode(seq)
+            self._strand_buffer = None
+            self.starts, self.ends, self.frames = orf_index(self.codes)
+            self.strands = np.ones(len(self.starts), dtype=np.int8)
+
+            if both_strands:
+                # minus strand orfs are found on the reverse complement, and mapped back to forward coordinates
+                L = len(self.codes)
+                starts, ends, frames = orf_index(self.strand_codes()[L:])
+                self.starts = np.concatenate((self.starts, L - ends))
+                self.ends = np.concatenate((self.ends, L - starts))
+                self.frames = np.concatenate((self.frames, frames))
+                self.strands = np.concatenate((self.strands, np.full(len(starts), -1, dtype=np.int8)))
+
+            self.frames = self.frames.astype(np.int8)
+            lengths = self.lengths
+            # long orfs
+            self.long_idxs = np.flatnonzero(lengths > self.long_len)
+            # short orfs
+            self.short_idxs = np.flatnonzero(lengths < self.short_len)
+            profile.count(bases=len(self.codes), orfs=len(self.starts))
+
+    def __getstate__(self):
+        # once the strand buffer is built, codes is a view of it: pickled on its own, it would be a second copy
+        state = {name: getattr(self, name) for name in self.__slots__}
+        if self._strand_buffer is not None:
+            state["codes"] = None
+        return state
+
+    def __setstate__(self, state):
+        for name, value in state.items():
+            setattr(self, name, value)
+        if self._strand_buffer is not None:
+            self.codes = self._strand_buffer[:len(self._strand_buffer) // 2]
+
+    @property
+    def seq(self):
+        return decode(self.codes)
+
+    @property
+    def lengths(self):
+        return self.ends - self.starts
+
+    @property
+    def both_strands(self):
+        return bool(len(self.strands)) and bool((self.strands < 0).any())
+
+    def strand_codes(self):
+        """ buffer of both strands, built on first use. the genome is then its first half """
+        if self._strand_buffer is None:
+            L = len(self.codes)
+            self._strand_buffer = strand_buffer(self.codes)
+            self.codes = self._strand_buffer[:L]
+        return self._strand_buffer
+
+    @property
+    def buffer(self):
+        """ the buffer orf ranges point into: the genome, or both strands if there are minus strand orfs """
+        return self.strand_codes() if self.both_strands else self.codes
+
+    def buffer_ranges(self, idxs=None):
+        """
+        ranges of the 5' to 3' sequences of orfs in the buffer
+        --
+        input: orf indices (all orfs if None) -> np.ndarray
+        output: buffer, start and end offsets into it -> np.ndarray, np.ndarray, np.ndarray
+        """
+        starts, ends, strands = self.starts, self.ends, self.strands
+        if idxs is not None:
+            starts, ends, strands = starts[idxs], ends[idxs], strands[idxs]
+        if not self.both_strands:
+            return self.codes, starts, ends
+
+        mirror = 2*len(self.codes)
+        minus = strands < 0
+        return self.strand_codes(), np.where(minus, mirror - ends, starts), np.where(minus, mirror - starts, ends)
+
+    def view(self, i):
+        """ zero-copy view of the base codes of the i-th orf """
+        buffer, starts, ends = self.buffer_ranges([i])
+        return buffer[starts[0]:ends[0]]
+
+    def long_ranges(self):
+        """ buffer ranges of the long orfs """
+        return self.buffer_ranges(self.long_idxs)
+
+    # background orfs: reverse complements of the long orfs, as mirrored ranges of the strand buffer
+    def background_ranges(self):
+        _, starts, ends = self.long_ranges()
+        mirror = 2*len(self.codes)
+        return self.strand_codes(), mirror - ends, mirror - starts
+
+    @property
+    def background(self):
+        return OrfSequences(*self.background_ranges())
+
+    # substrings and location lists are materialized from the index only when asked for
+    def locations(self, idxs=None):
+        if idxs is None:
+            return list(zip(self.starts, self.ends))
+        return list(zip(self.starts[idxs], self.ends[idxs]))
+
+    def sequences(self, idxs=None):
+        return OrfSequences(*self.buffer_ranges(idxs))
+
+    def frame_idxs(self, frame, strand=1):
+        return np.flatnonzero((self.frames == frame) & (self.strands == strand))
+
+    # for reading frame starting at index = 0 (or index = 1 in biology), 1, and 2
+    @property
+    def idxs0(self):
+        return self.locations(self.frame_idxs(0))
+
+    @property
+    def idxs1(self):
+        return self.locations(self.frame_idxs(1))
+
+    @property
+    def idxs2(self):
+        return self.locations(self.frame_idxs(2))
+
+    @property
+    def orf0(self):
+        return self.sequences(self.frame_idxs(0))
+
+    @property
+    def orf1(self):
+        return self.sequences(self.frame_idxs(1))
+
+    @property
+    def orf2(self):
+        return self.sequences(self.frame_idxs(2))
+
+    # total orfs
+    @property
+    def total_orfs(self):
+        return self.sequences()
+
+    @property
+    def all_orf_locations(self):
+        return self.locations()
+
+    @property
+    def long_orfs(self):
+        return self.sequences(self.long_idxs)
+
+    @property
+    def long_orfs_location(self):
+        return self.locations(self.long_idxs)
+
+    @property
+    def short_orfs(self):
+        return self.sequences(self.short_idxs)
+
+    @property
+    def short_orfs_location(self):
+        return self.locations(self.short_idxs)
 
-        # for reading frame starting at index = 0 (or index = 1 in biology)
-        self.idxs0, self.orf0 = orf_seqs(seq, 0)
-        # for reading frame starting at index = 1 
-        self.idxs1, self.orf1 = orf_seqs(seq, 1)
-        # for reading frame starting at index = 2
-        self.idxs2, self.orf2 = orf_seqs(seq, 2)
-        # total orfs
-        self.total_orfs = self.orf0 + self.orf1 + self.orf2
-        self.all_orf_locations = self.idxs0 + self.idxs1 + self.idxs2
-        # long orfs
-        self.long_orfs = [x for x,y in zip(self.total_orfs,self.all_orf_locations) if len(x)> self.long_len]
-        self.long_orfs_location = [y for x,y in zip(self.total_orfs,self.all_orf_locations) if len(x)> self.long_len]
-        # short orfs
-        self.short_orfs = [x for x,y in zip(self.total_orfs,self.all_orf_locations) if len(x)< self.short_len]
-        self.short_orfs_location = [y for x,y in zip(self.total_orfs,self.all_orf_locations) if len(x)< self.short_len]
-        # calculate background orfs from long_orfs
-        self.background = background_seqs(self.long_orfs)
+    def __len__(self):
+        return len(self.starts)
 
     def __repr__(self):
         return "total number of orfs found: {} \
             \nnumber of long orfs: {} \
-            \nnumber of short orfs: {} ".format(len(self.total_orfs), len(self.long_orfs), len(self.short_orfs))
+            \nnumber of short orfs: {} ".format(len(self.starts), len(self.long_idxs), len(self.short_idxs))
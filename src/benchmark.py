@@ -0,0 +1,239 @@
+# benchmark suite: ORF extraction, kmer counting, training, scoring and gold set matching on synthetic genomes
+#   python src/benchmark.py run -sizes 1,10,100 -ks 3,5,7 -o output/bench.json
+#   python src/benchmark.py compare output/bench_old.json output/bench.json
+# synthetic genomes are generated from a seed, so every run of a size benchmarks the same sequence. they're written
+# (with a GFF3 of their planted genes as gold set) under data/synthetic, and reused by later runs.
+
+import argparse
+import json
+import os
+import platform
+import sys
+import time
+import tracemalloc
+import numpy as np
+from MarkovModel import MarkovModel
+from ORF import ORF, background_seqs, find_stops, orf_seqs
+from encoding import BASE_LETTERS, COMPLEMENT_CODES
+from fasta import read_fna
+from gff import read_gold_set
+
+MB = 1000000
+
+# synthetic genome parameters, roughly M. jannaschii: low GC, gene dense, ~1 kb genes with short intergenic regions
+GC = 0.31
+MEAN_GENE_CODONS = 300
+MIN_GENE_CODONS = 60
+MEAN_INTERGENIC = 120
+BLOCK = 10 * MB
+LINE = 80
+
+# codons as base code triplets, codon index = 16*b1 + 4*b2 + b3
+CODONS = np.array([[i >> 4, (i >> 2) & 3, i & 3] for i in range(64)], dtype=np.uint8)
+STOPS = [0b110000, 0b110010, 0b111000]  # TAA, TAG, TGA
+START = np.array([0, 3, 2], dtype=np.uint8)  # ATG
+
+
+def base_probabilities(gc=GC):
+    return np.array([(1 - gc) / 2, gc / 2, gc / 2, (1 - gc) / 2])
+
+
+def codon_probabilities(gc=GC):
+    """ codon usage of the planted genes: the product of base frequencies, without stop codons """
+    p = base_probabilities(gc)
+    probs = p[CODONS].prod(axis=1)
+    probs[STOPS] = 0
+    return probs / probs.sum()
+
+
+def synthetic_block(rng, n, gc=GC):
+    """
+    n bases of synthetic genome: random background with genes (ATG, sense codons, stop) planted on both strands
+    --
+    output: base codes -> np.ndarray, planted genes as 0-based [start, end) spans including the stop codon and their strands -> np.ndarray x3
+    """
+    codes = rng.choice(4, size=n, p=base_probabilities(gc)).astype(np.uint8)
+
+    # gene and intergenic lengths, laid out one after the other until the block is full
+    count = int(n / (3 * MEAN_GENE_CODONS + MEAN_INTERGENIC) * 1.5) + 1
+    codons = MIN_GENE_CODONS + rng.geometric(1 / (MEAN_GENE_CODONS - MIN_GENE_CODONS), size=count)
+    lengths = 3 * (codons + 2)
+    gaps = rng.geometric(1 / MEAN_INTERGENIC, size=count)
+    starts = np.cumsum(gaps + lengths) - lengths
+    fits = starts + lengths <= n
+    starts, lengths, codons = starts[fits], lengths[fits], codons[fits]
+    strands = np.where(rng.random(len(starts)) < 0.5, 1, -1).astype(np.int8)
+
+    # gene sequences, concatenated: ATG, sense codons, stop
+    offsets = np.cumsum(lengths) - lengths
+    genes = np.empty(lengths.sum(), dtype=np.uint8)
+    body = CODONS[rng.choice(64, size=codons.sum(), p=codon_probabilities(gc))].reshape(-1)
+    in_body = np.ones(len(genes), dtype=bool)
+    for j in range(3):
+        genes[offsets + j] = START[j]
+        in_body[offsets + j] = False
+        in_body[offsets + lengths - 3 + j] = False
+    stops = CODONS[rng.choice(STOPS, size=len(starts))]
+    for j in range(3):
+        genes[offsets + lengths - 3 + j] = stops[:, j]
+    genes[in_body] = body
+
+    # place them, reverse complemented on the minus strand
+    gene_of = np.repeat(np.arange(len(starts)), lengths)
+    within = np.arange(len(genes)) - offsets[gene_of]
+    minus = strands[gene_of] < 0
+    destinations = starts[gene_of] + np.where(minus, lengths[gene_of] - 1 - within, within)
+    codes[destinations] = np.where(minus, COMPLEMENT_CODES[genes], genes)
+    return codes, starts, starts + lengths, strands
+
+
+def synthetic_genome(size_mb, directory="data/synthetic", seed=0, gc=GC):
+    """ path of a synthetic genome of the given size (and its gold set GFF3), generated block by block unless it exists """
+    name = "synthetic_{}mb_seed{}".format(size_mb, seed)
+    fna = os.path.join(directory, name + ".fna")
+    gff = os.path.join(directory, name + ".gff")
+    if os.path.exists(fna) and os.path.exists(gff):
+        return fna, gff
+
+    os.makedirs(directory, exist_ok=True)
+    n = int(size_mb * MB)
+    with open(fna + ".tmp", "w") as f, open(gff + ".tmp", "w") as g:
+        f.write(">{} synthetic genome, {} bases, GC {}, seed {}\n".format(name, n, gc, seed))
+        g.write("##gff-version 3\n")
+        for i, offset in enumerate(range(0, n, BLOCK)):
+            codes, starts, ends, strands = synthetic_block(np.random.default_rng([seed, i]), min(BLOCK, n - offset), gc)
+            text = BASE_LETTERS[codes].tobytes().decode("ascii")
+            f.write("".join(text[j:j+LINE] + "\n" for j in range(0, len(text), LINE)))
+            for j, (start, end, strand) in enumerate(zip(starts + offset, ends + offset, strands)):
+                g.write("{}\tsynthetic\tCDS\t{}\t{}\t.\t{}\t0\tID=gene{}_{}\n".format(name, start + 1, end, "+" if strand > 0 else "-", i, j))
+    os.replace(fna + ".tmp", fna)
+    os.replace(gff + ".tmp", gff)
+    return fna, gff
+
+
+def measure(fn, repeat=1):
+    """
+    run fn once under tracemalloc for its peak memory, then repeat times untraced for its best wall time
+    --
+    output: result of the last run, seconds -> float, peak traced memory in MB -> float
+    """
+    tracemalloc.start()
+    result = fn()
+    peak = tracemalloc.get_traced_memory()[1] / MB
+    tracemalloc.stop()
+
+    seconds = np.inf
+    for _ in range(repeat):
+        result = None
+        begin = time.perf_counter()
+        result = fn()
+        seconds = min(seconds, time.perf_counter() - begin)
+    return result, seconds, peak
+
+
+def benchmark_genome(size_mb, ks, repeat=1, directory="data/synthetic", seed=0, log=print):
+    """ benchmark every stage on a synthetic genome of the given size, the model stages once per k """
+    fna, gff = synthetic_genome(size_mb, directory, seed)
+    rows = []
+
+    def run(name, fn, k=None):
+        result, seconds, peak = measure(fn, repeat)
+        rows.append({"name": name, "size_mb": size_mb, "k": k, "seconds": seconds, "peak_mb": peak})
+        log("{:>6} Mb  {:<28} {:>8.3f}s {:>10.1f} MB".format(size_mb, name + ("" if k is None else " k={}".format(k)), seconds, peak))
+        return result
+
+    records = run("read_fna", lambda: read_fna(fna))
+    seq, seqid = records[0].sequence, records[0].seq_id
+    run("find_stops", lambda: find_stops(seq))
+    run("orf_seqs", lambda: orf_seqs(seq, 0))
+    orfs = run("ORF", lambda: ORF(seq))
+    long_orfs = list(orfs.long_orfs)
+    run("background_seqs", lambda: background_seqs(long_orfs))
+    gold = run("read_gold_set", lambda: read_gold_set(gff, seqid))
+    run("label", lambda: gold.label(orfs.ends))
+
+    for k in ks:
+        mm = run("MarkovModel", lambda: MarkovModel(k, 1, orfs), k)
+        run("count_kmers", lambda: mm.count_kmers(k, long_orfs), k)
+        run("score", lambda: [mm.score(x) for x in long_orfs[:1000]], k)
+        # uncached, or every timed run after the first would be a score cache hit
+        run("results", lambda: mm.results(cache=None), k)
+    return rows
+
+
+def environment():
+    return {"python": platform.python_version(), "numpy": np.__version__, "platform": platform.platform(),
+            "machine": platform.machine(), "cpus": os.cpu_count(), "date": time.strftime("%Y-%m-%dT%H:%M:%S")}
+
+
+def compare(old, new, tolerance=0.1, min_seconds=0.01):
+    """
+    regressions between two benchmark runs: benchmarks whose time or peak memory grew by more than the tolerance
+    (times below min_seconds are too noisy to compare)
+    --
+    output: one line per benchmark in both runs -> list of dict, with "regression" set on regressions
+    """
+    before = {(row["name"], row["size_mb"], row["k"]): row for row in old["results"]}
+    lines = []
+    for row in new["results"]:
+        key = (row["name"], row["size_mb"], row["k"])
+        if key not in before:
+            continue
+        base = before[key]
+        time_ratio = row["seconds"] / base["seconds"] if base["seconds"] > 0 else np.inf
+        memory_ratio = row["peak_mb"] / base["peak_mb"] if base["peak_mb"] > 0 else np.inf
+        slower = time_ratio > 1 + tolerance and row["seconds"] - base["seconds"] > min_seconds
+        larger = memory_ratio > 1 + tolerance and row["peak_mb"] - base["peak_mb"] > 1
+        lines.append(dict(row, time_ratio=time_ratio, memory_ratio=memory_ratio, regression=slower or larger))
+    return lines
+
+
+def main():
+    parser = argparse.ArgumentParser(description="benchmark ORF extraction, kmer counting, training and scoring on synthetic genomes")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    run_parser = commands.add_parser("run", help="run the benchmarks and write their results as JSON")
+    run_parser.add_argument("-sizes", default="1,10", help="comma separated genome sizes in Mb, e.g. 1,10,100,500")
+    run_parser.add_argument("-ks", default="3,5,7", help="comma separated markov model orders")
+    run_parser.add_argument("-repeat", type=int, default=3, help="timed runs per benchmark, the best is kept")
+    run_parser.add_argument("-seed", type=int, default=0)
+    run_parser.add_argument("-dir", default="data/synthetic", help="where synthetic genomes are written and reused from")
+    run_parser.add_argument("-o", "-out", dest="out", default="output/benchmark.json")
+
+    compare_parser = commands.add_parser("compare", help="flag regressions between two benchmark JSON files")
+    compare_parser.add_argument("old")
+    compare_parser.add_argument("new")
+    compare_parser.add_argument("-tolerance", type=float, default=0.1, help="relative growth in time or memory that counts as a regression")
+    compare_parser.add_argument("-min_seconds", type=float, default=0.01, help="ignore time differences smaller than this")
+    args = parser.parse_args()
+
+    if args.command == "run":
+        sizes = [float(x) if "." in x else int(x) for x in args.sizes.split(",")]
+        ks = [int(x) for x in args.ks.split(",")]
+        rows = []
+        for size_mb in sizes:
+            rows += benchmark_genome(size_mb, ks, args.repeat, args.dir, args.seed)
+        report = {"environment": environment(), "config": {"sizes_mb": sizes, "ks": ks, "repeat": args.repeat, "seed": args.seed},
+                  "results": rows}
+        os.makedirs(os.path.dirname(args.out) or ".", exist_ok=True)
+        with open(args.out, "w") as f:
+            json.dump(report, f, indent=2)
+        print("wrote {}".format(args.out))
+        return
+
+    with open(args.old) as f:
+        old = json.load(f)
+    with open(args.new) as f:
+        new = json.load(f)
+    lines = compare(old, new, args.tolerance, args.min_seconds)
+    for line in lines:
+        name = line["name"] + ("" if line["k"] is None else " k={}".format(line["k"]))
+        print("{:>6} Mb  {:<28} time x{:<6.2f} memory x{:<6.2f} {}".format(
+            line["size_mb"], name, line["time_ratio"], line["memory_ratio"], "REGRESSION" if line["regression"] else ""))
+    regressions = sum(line["regression"] for line in lines)
+    print("{} regressions in {} benchmarks".format(regressions, len(lines)))
+    sys.exit(1 if regressions else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,125 @@
+# command line entry point
+#   python src/cli.py train    -fna genome.fna -k 5 -o model.npz
+#   python src/cli.py score    model.npz genome.fna -o calls.gff
+#   python src/cli.py evaluate model.npz -fna genome.fna -gff genome.gff
+#   python src/cli.py plot     -k 5 -r 0.2           (the plots of train_model.py, -sweeps for those of extra.py)
+#   python src/cli.py crossval -k 4 5 6 -folds 5     (k-fold cross-validated AUC over a parameter grid)
+# every subcommand imports what it needs when it runs, so scoring doesn't pay for pandas or matplotlib.
+
+import argparse
+import sys
+from crossval import add_arguments as add_crossval_arguments
+from pipeline import add_arguments as add_score_arguments, score
+from train_model import FNA, GFF, add_model_arguments, with_defaults
+
+
+def train(args):
+    """ train a model (or load it from the model cache) and save it """
+    from genome_cache import read_genome
+    from train_model import load_model
+
+    mm = load_model(args, read_genome(args.fna))
+    mm.save(args.out)
+    print("saved k={} pseudocount={} long_len={} model to {}".format(mm.k, mm.pseudocount, mm.long_len, args.out), file=sys.stderr)
+
+
+def evaluate(args):
+    """ AUC and operating point of a saved model's scores against the gold set """
+    import json
+    from MarkovModel import MarkovModel
+    from ORF import ORF
+    from evaluation import Evaluation
+    from genome_cache import read_genome
+    from gff import read_gold_set
+
+    data = read_genome(args.fna)
+    mm = MarkovModel.load(args.model, ORF(data[0].sequence, short_len=args.shortl, both_strands=args.both_strands))
+    goldens = read_gold_set(args.gff, data[0].seq_id, None if args.both_strands else "+")
+    labels, _ = goldens.label(mm.orfs.ends, mm.orfs.starts, mm.orfs.strands)
+    ev = Evaluation(labels, mm.orf_scores(), target=args.target)
+
+    summary = {"model": args.model, "k": mm.k, "pseudocount": mm.pseudocount, "long_len": mm.long_len, "orfs": len(mm.orfs),
+               "gold_set": len(goldens), "matches": int(labels.sum()), "auc": ev.auc, "threshold": float(ev.threshold),
+               "accuracy": ev.accuracy}
+    print(json.dumps(summary, indent=2))
+
+
+def plot(args):
+    """ the ROC and decision boundary plots of train_model.py, or with -sweeps the parameter sweeps of extra.py """
+    if args.sweeps:
+        import extra
+        print(extra.run(args.fna, args.gff, args.output))
+        return
+
+    from genome_cache import read_genome
+    from gff import read_gold_set
+    from train_model import load_model, plot as plot_results, score_genome
+
+    data = read_genome(args.fna)
+    goldens = read_gold_set(args.gff, data[0].seq_id, None if args.both_strands else "+")
+    mm = load_model(args, data)
+    plot_results(score_genome(mm, goldens, args.score_processes), args.k, args.pseudo, args.longl, args.shortl, args.r, args.output)
+
+
+def crossval(args):
+    """ k-fold cross-validated AUC over a parameter grid, see crossval.py """
+    from crossval import cross_validate
+
+    print(cross_validate(args).to_string(index=False))
+
+
+def parser():
+    parser = argparse.ArgumentParser(description="gene prediction with markov models")
+    parser.add_argument("-profile", "--profile", metavar="FILE",
+                        help="time every pipeline stage, and print a report (-) or dump the metrics to a .json or .prom (Prometheus textfile) file")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    train_parser = commands.add_parser("train", help="train a model and save it as .npz")
+    add_model_arguments(train_parser)
+    train_parser.add_argument("-o", "-out", dest="out", default="model.npz")
+    train_parser.set_defaults(run=train)
+
+    score_parser = commands.add_parser("score", help="score every ORF of a FASTA file, writing calls as GFF3 or TSV")
+    add_score_arguments(score_parser)
+    score_parser.set_defaults(run=score)
+
+    evaluate_parser = commands.add_parser("evaluate", help="AUC of a saved model's scores against the gold set")
+    evaluate_parser.add_argument("model", help="model saved by train")
+    evaluate_parser.add_argument("-fna", default=FNA, help="genome FASTA file, the first record is scored")
+    evaluate_parser.add_argument("-gff", default=GFF, help="GFF3 annotation the gold set is read from")
+    evaluate_parser.add_argument("-shortl", type=int, default=50)
+    evaluate_parser.add_argument("-both_strands", action="store_true", help="score ORFs in all six reading frames against both strands' genes")
+    evaluate_parser.add_argument("-target", type=float, default=0.8, help="accuracy of the reported operating point")
+    evaluate_parser.set_defaults(run=evaluate)
+
+    plot_parser = commands.add_parser("plot", help="ROC curve and decision boundary plots")
+    add_model_arguments(plot_parser)
+    plot_parser.add_argument("-r", type=float, action="store")
+    plot_parser.add_argument("-gff", default=GFF, help="GFF3 annotation the gold set is read from")
+    plot_parser.add_argument("-output", default="output", help="directory the plots are written to")
+    plot_parser.add_argument("-sweeps", action="store_true", help="plot the parameter sweeps of extra.py instead")
+    plot_parser.set_defaults(run=plot)
+
+    crossval_parser = commands.add_parser("crossval", help="k-fold cross-validated AUC over a parameter grid")
+    add_crossval_arguments(crossval_parser)
+    crossval_parser.set_defaults(run=crossval)
+    return parser
+
+
+def main(argv=None):
+    args = parser().parse_args(argv)
+    if args.command in ("train", "plot"):
+        with_defaults(args)
+    if args.profile:
+        import profiling
+        profiling.enable()
+    if getattr(args, "score_cache", None):
+        import score_cache
+        score_cache.configure(directory=args.score_cache)
+    args.run(args)
+    if args.profile:
+        profiling.dump(args.profile)
+
+
+if __name__ == "__main__":
+    main()
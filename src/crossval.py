@@ -0,0 +1,157 @@
+# k-fold cross-validation of the markov model on one genome
+#   python src/crossval.py -folds 5 -k 3 4 5 6 -pseudo 0.5 1 -longl 1000 1400 -r 0.1 0.2 0.3
+# the gold set is really a dev set: extra.py scores the same ORFs the models are trained on. here the genome is cut
+# into contiguous folds, and the ORFs starting in a fold are scored by a model trained without the long ORFs of that
+# fold. nothing is recounted per fold: the genome is counted once for every long_len (see sweep.Sweep), the long ORFs
+# of each fold are counted once, and a fold model is the full counts minus its fold's counts (TrainingCounts.__sub__).
+# the flashbulb line of each r is fitted on the training folds' scores, and evaluated on the held out fold by the AUC
+# of its combined score and the accuracy of its decision boundary (r only moves the boundary, so it's the accuracy that
+# changes with r, not the AUC). the (k, pseudocount, long_len) configurations are evaluated in a process pool, each
+# one for every fold and r, and summarized as the mean and standard deviation over the folds, with the wall time of
+# each configuration.
+
+import argparse
+import itertools
+import time
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+from evaluation import combined_scores, flashbulb_line, roc_auc
+from sweep import Sweep
+from train_model import FNA, GFF
+
+COLUMNS = ["k", "pseudocount", "long_len", "r", "fold", "auc", "combined_auc", "accuracy", "seconds"]
+
+
+def fold_index(starts, length, folds):
+    """ fold of every ORF: the genome is cut into folds of equal length, and an ORF belongs to the one it starts in """
+    return (np.asarray(starts, dtype=np.int64) * folds // length).astype(np.int64)
+
+
+class CrossValidation:
+    """ folds of a sweep's genome, with the gold set match of every ORF and the training counts of every fold """
+    def __init__(self, sweep, labels, folds=5):
+        self.sweep = sweep
+        self.labels = np.asarray(labels, dtype=bool)
+        self.folds = folds
+        self.fold = fold_index(sweep.orfs.starts, len(sweep.orfs.codes), folds)
+        self.long_fold = self.fold[sweep.orfs.long_idxs]
+        self.fold_counts = [sweep.count_long_lens(self.long_fold == f) for f in range(folds)]
+
+    def model(self, fold, k, pseudocount, long_len):
+        """ markov model trained on every fold but one: the full counts minus that fold's counts """
+        counts = self.sweep.training_counts(k, long_len) - \
+            self.sweep.training_counts(k, long_len, self.fold_counts[fold], self.long_fold == fold)
+        return counts.model(pseudocount, self.sweep.orfs, self.sweep.orfs.short_len)
+
+    def evaluate(self, k, pseudocount, long_len, rs=(0.2,)):
+        """
+        held out AUC of the markov score of every fold, and AUC and decision boundary accuracy of the combined score of every r
+        --
+        output: one row per fold and r -> list of dict
+        """
+        lengths = self.sweep.orfs.lengths
+        short_len = self.sweep.orfs.short_len
+        rows = []
+        for fold in range(self.folds):
+            scores = self.model(fold, k, pseudocount, long_len).orf_scores(cache=None)
+            test = self.fold == fold
+            auc = roc_auc(self.labels[test], scores[test])
+            for r in rs:
+                m, y_intercept, _, _ = flashbulb_line(lengths[~test], scores[~test], long_len, short_len, r)
+                combined = combined_scores(lengths[test], scores[test], m, y_intercept)
+                rows.append({"k": k, "pseudocount": pseudocount, "long_len": long_len, "r": r, "fold": fold,
+                             "auc": auc, "combined_auc": roc_auc(self.labels[test], combined),
+                             "accuracy": float(np.mean((combined > 0) == self.labels[test]))})
+        return rows
+
+
+# the cross-validation of a process pool's workers, set once per worker by init_worker
+_cv = None
+
+
+def init_worker(cv):
+    global _cv
+    _cv = cv
+
+
+def evaluate_config(task):
+    """ worker: every fold and r of one (k, pseudocount, long_len) configuration, and its wall time """
+    k, pseudocount, long_len, rs = task
+    start = time.perf_counter()
+    rows = _cv.evaluate(k, pseudocount, long_len, rs)
+    seconds = time.perf_counter() - start
+    for row in rows:
+        row["seconds"] = seconds
+    return rows
+
+
+def run(cv, ks, pseudos, longls, rs=(0.2,), processes=None):
+    """
+    evaluate every configuration of the grid, in a process pool
+    --
+    input: cross-validation -> CrossValidation, parameter values -> list x4, pool size (None = all cores, 1 = no pool) -> int
+    output: one row per configuration, fold and r -> pd.DataFrame
+    """
+    import pandas as pd
+
+    tasks = [(k, pseudocount, long_len, tuple(rs)) for k, pseudocount, long_len in itertools.product(ks, pseudos, longls)]
+    if processes == 1 or len(tasks) == 1:
+        init_worker(cv)
+        rows = list(map(evaluate_config, tasks))
+    else:
+        with ProcessPoolExecutor(processes, initializer=init_worker, initargs=(cv,)) as pool:
+            rows = list(pool.map(evaluate_config, tasks))
+    return pd.DataFrame([row for config_rows in rows for row in config_rows], columns=COLUMNS)
+
+
+def summarize(df_folds):
+    """ mean and standard deviation over the folds of each configuration's AUCs, with its wall time -> pd.DataFrame """
+    summary = df_folds.groupby(["k", "pseudocount", "long_len", "r"]).agg(
+        auc_mean=("auc", "mean"), auc_std=("auc", "std"),
+        combined_auc_mean=("combined_auc", "mean"), combined_auc_std=("combined_auc", "std"),
+        accuracy_mean=("accuracy", "mean"), accuracy_std=("accuracy", "std"),
+        seconds=("seconds", "first"))
+    return summary.reset_index()
+
+
+def add_arguments(parser):
+    """ arguments of the cross-validation, shared with cli.py """
+    parser.add_argument("-fna", default=FNA, help="genome FASTA file, the first record is used")
+    parser.add_argument("-gff", default=GFF, help="GFF3 annotation the gold set is read from")
+    parser.add_argument("-folds", type=int, default=5, help="number of contiguous genome folds")
+    parser.add_argument("-k", type=int, nargs="+", default=[5])
+    parser.add_argument("-pseudo", type=float, nargs="+", default=[1])
+    parser.add_argument("-longl", type=int, nargs="+", default=[1400])
+    parser.add_argument("-r", type=float, nargs="+", default=[0.2])
+    parser.add_argument("-shortl", type=int, default=50)
+    parser.add_argument("-both_strands", action="store_true", help="find ORFs in all six reading frames, not just the forward strand")
+    parser.add_argument("-processes", type=int, action="store", help="size of the process pool, defaults to all cores")
+    parser.add_argument("-folds_csv", help="also write the AUC of every fold to this CSV file")
+
+
+def cross_validate(args):
+    """ cross-validate the grid of the parsed arguments, and return the summary table """
+    from genome_cache import read_genome
+    from gff import read_gold_set
+
+    data = read_genome(args.fna)
+    goldens = read_gold_set(args.gff, data[0].seq_id, None if args.both_strands else "+")
+    sweep = Sweep(data[0].sequence, max(args.k), args.longl, args.shortl, args.both_strands)
+    labels, _ = goldens.label(sweep.orfs.ends, sweep.orfs.starts, sweep.orfs.strands)
+
+    cv = CrossValidation(sweep, labels, args.folds)
+    df_folds = run(cv, args.k, args.pseudo, args.longl, args.r, args.processes)
+    if args.folds_csv:
+        df_folds.to_csv(args.folds_csv, index=False)
+    return summarize(df_folds)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="k-fold cross-validated AUC of the markov model over a parameter grid")
+    add_arguments(parser)
+    args = parser.parse_args(argv)
+    print(cross_validate(args).to_string(index=False))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,137 @@
+# integer encoding of nucleotide sequences
+# A, C, G, T are packed as 0, 1, 2, 3 (2 bits per base) so kmers can be
+# represented as integer codes instead of substrings. anything else is INVALID.
+
+import hashlib
+import numpy as np
+
+nucleotides = "ACGT"
+INVALID = 4
+
+# byte -> base code lookup, lower case bases are accepted as well
+BASE_CODES = np.full(256, INVALID, dtype=np.uint8)
+for code, base in enumerate(nucleotides):
+    BASE_CODES[ord(base)] = code
+    BASE_CODES[ord(base.lower())] = code
+
+# base code -> byte lookup, INVALID decodes to N
+BASE_LETTERS = np.frombuffer(b"ACGTN", dtype=np.uint8)
+
+# base code -> code of the complementary base (A <-> T, C <-> G)
+COMPLEMENT_CODES = np.array([3, 2, 1, 0, INVALID], dtype=np.uint8)
+
+
+def encode(seq):
+    """ encode a nucleotide string (or bytes) into an array of base codes """
+    if isinstance(seq, np.ndarray):
+        return seq
+    if isinstance(seq, str):
+        seq = seq.encode("ascii")
+    return BASE_CODES[np.frombuffer(seq, dtype=np.uint8)]
+
+
+def decode(codes):
+    """ turn an array of base codes back into a nucleotide string """
+    return BASE_LETTERS[codes].tobytes().decode("ascii")
+
+
+def reverse_complement(codes):
+    """ reverse complement of an encoded sequence, as a new array """
+    return COMPLEMENT_CODES[codes[::-1]]
+
+
+def digest(codes):
+    """ content hash (sha256 hex digest) of an encoded sequence """
+    return hashlib.sha256(np.ascontiguousarray(codes, dtype=np.uint8)).hexdigest()
+
+
+def encode_many(seqs):
+    """
+    encode a list of sequences into one shared buffer
+    --
+    input: list of sequences -> list of str
+    output: base codes of all sequences concatenated -> np.ndarray, start and end offsets of each sequence -> np.ndarray, np.ndarray
+    """
+    lengths = np.fromiter((len(x) for x in seqs), dtype=np.int64, count=len(seqs))
+    ends = np.cumsum(lengths)
+    starts = ends - lengths
+    buffer = encode("".join(seqs))
+    return buffer, starts, ends
+
+
+# kmer string -> base 4 digits, so a kmer code is just int(digits, 4)
+KMER_DIGITS = str.maketrans("ACGTacgt", "01230123")
+
+
+def kmer_code(kmer):
+    """ integer code of a single kmer, first base is the most significant. -1 if the kmer is not pure ACGT """
+    try:
+        return int(kmer.translate(KMER_DIGITS), 4)
+    except ValueError:
+        return -1
+
+
+def kmer_string(code, k):
+    """ kmer string of a given integer code """
+    letters = []
+    for _ in range(k):
+        letters.append(nucleotides[code & 3])
+        code >>= 2
+    return "".join(reversed(letters))
+
+
+def rolling_codes(codes, k):
+    """
+    integer codes of every kmer in an encoded sequence, i.e. codes[i] is the kmer starting at position i
+    --
+    input: base codes -> np.ndarray, k -> int
+    output: kmer codes, -1 where the kmer covers an invalid base -> np.ndarray (int64) of length len(codes)-k+1
+    """
+    n = len(codes) - k + 1
+    if n <= 0:
+        return np.empty(0, dtype=np.int64)
+
+    kmers = np.zeros(n, dtype=np.int64)
+    invalid = np.zeros(n, dtype=bool)
+    for j in range(k):
+        window = codes[j:j+n]
+        kmers <<= 2
+        kmers |= window & 3
+        invalid |= window == INVALID
+    kmers[invalid] = -1
+    return kmers
+
+
+def range_coverage(starts, ends, k, n):
+    """ number of [start, end) ranges that contain each of the n kmer positions, overlapping ranges count once each """
+    fits = ends - starts >= k
+    delta = np.zeros(n + 1, dtype=np.int64)
+    np.add.at(delta, starts[fits], 1)
+    np.add.at(delta, ends[fits] - k + 1, -1)
+    return np.cumsum(delta[:n])
+
+
+def prefix_codes(codes, starts, ends, k):
+    """ code of the first kmer of each [start, end) range, -1 where the range is shorter than k or covers an invalid base """
+    starts = np.asarray(starts, dtype=np.int64)
+    fits = np.asarray(ends, dtype=np.int64) - starts >= k
+    positions = starts[fits]
+
+    kmers = np.zeros(len(positions), dtype=np.int64)
+    invalid = np.zeros(len(positions), dtype=bool)
+    for j in range(k):
+        window = codes[positions + j]
+        kmers <<= 2
+        kmers |= window & 3
+        invalid |= window == INVALID
+    kmers[invalid] = -1
+
+    result = np.full(len(starts), -1, dtype=np.int64)
+    result[fits] = kmers
+    return result
+
+
+def suffix_codes(codes, starts, ends, k):
+    """ code of the last kmer of each [start, end) range, -1 where the range is shorter than k or covers an invalid base """
+    ends = np.asarray(ends, dtype=np.int64)
+    return prefix_codes(codes, np.maximum(ends - k, starts), ends, k)
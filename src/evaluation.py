@@ -0,0 +1,142 @@
+# vectorized evaluation of ORF scores against the gold set
+# scores are sorted once, and the confusion counts at every threshold come from cumulative sums,
+# so the ROC curve, AUC and accuracy at every threshold cost O(n log n) in total.
+
+import numpy as np
+from statistics import median
+from profiling import stage
+
+
+def roc(labels, scores):
+    """
+    ROC curve at every distinct score, same points as sklearn's roc_curve(..., drop_intermediate=False)
+    --
+    input: gold set match of every ORF -> np.ndarray of bool, ORF scores -> np.ndarray
+    output: false positive rates, true positive rates, thresholds (predict a match when score >= threshold) -> np.ndarray x3
+    """
+    labels = np.asarray(labels, dtype=bool)
+    scores = np.asarray(scores, dtype=np.float64)
+    order = np.argsort(scores, kind="mergesort")[::-1]
+    scores, labels = scores[order], labels[order]
+
+    # last index of each run of equal scores
+    threshold_idxs = np.r_[np.flatnonzero(np.diff(scores)), len(scores) - 1]
+    tps = np.cumsum(labels)[threshold_idxs]
+    fps = threshold_idxs + 1 - tps
+
+    tps = np.r_[0, tps]
+    fps = np.r_[0, fps]
+    thresholds = np.r_[np.inf, scores[threshold_idxs]]
+    with np.errstate(invalid="ignore", divide="ignore"):
+        return fps / fps[-1], tps / tps[-1], thresholds
+
+
+def auc(fpr, tpr):
+    """ area under a ROC curve by the trapezoidal rule """
+    return float(np.sum(np.diff(fpr) * (tpr[1:] + tpr[:-1]) / 2))
+
+
+def roc_auc(labels, scores):
+    """ area under the ROC curve of a set of scores, same as sklearn's roc_auc_score """
+    return auc(*roc(labels, scores)[:2])
+
+
+def confusion(labels, scores, thresholds):
+    """
+    confusion counts of predicting a match when score > threshold, at every threshold at once
+    --
+    output: true positives, false positives, true negatives, false negatives -> np.ndarray x4
+    """
+    labels = np.asarray(labels, dtype=bool)
+    scores = np.asarray(scores, dtype=np.float64)
+    positives = np.sort(scores[labels])
+    negatives = np.sort(scores[~labels])
+
+    tp = len(positives) - np.searchsorted(positives, thresholds, side="right")
+    fp = len(negatives) - np.searchsorted(negatives, thresholds, side="right")
+    return tp, fp, len(negatives) - fp, len(positives) - tp
+
+
+def accuracies(labels, scores, thresholds):
+    """ accuracy of predicting a match when score > threshold, at every threshold """
+    tp, fp, tn, fn = confusion(labels, scores, thresholds)
+    return (tp + tn) / len(labels)
+
+
+def operating_point(labels, scores, thresholds, target=0.8):
+    """ index of the threshold whose accuracy is nearest to the target accuracy """
+    return int(np.abs(accuracies(labels, scores, thresholds) - target).argmin())
+
+
+def decimate(fpr, tpr, max_points=1000, keep=()):
+    """
+    indices of a subset of ROC points for plotting: collinear points are dropped (as sklearn's drop_intermediate),
+    then if there are still more than max_points they are sampled evenly along the curve.
+    the end points and the indices in keep (i.e. operating points) are always kept
+    """
+    n = len(fpr)
+    if n <= 2:
+        return np.arange(n)
+
+    corners = np.r_[True, np.logical_or(np.diff(fpr, 2), np.diff(tpr, 2)), True]
+    idxs = np.flatnonzero(corners)
+    if len(idxs) > max_points:
+        distance = np.r_[0, np.cumsum(np.hypot(np.diff(fpr[idxs]), np.diff(tpr[idxs])))]
+        targets = np.linspace(0, distance[-1], max_points)
+        idxs = idxs[np.unique(np.searchsorted(distance, targets).clip(0, len(idxs) - 1))]
+    return np.unique(np.r_[0, idxs, n - 1, np.asarray(keep, dtype=np.int64)])
+
+
+class Evaluation:
+    """ ROC curve, AUC and operating point of one set of scores """
+    def __init__(self, labels, scores, target=0.8, max_points=1000):
+        with stage("roc", orfs=len(scores)):
+            self.fpr, self.tpr, self.thresholds = roc(labels, scores)
+            self.auc = auc(self.fpr, self.tpr)
+            self.idx = operating_point(labels, scores, self.thresholds, target)
+            self.accuracy = float(accuracies(labels, scores, self.thresholds[self.idx:self.idx+1])[0])
+            # decimated curve for plotting
+            self.plot_idxs = decimate(self.fpr, self.tpr, max_points, [self.idx])
+
+    @property
+    def threshold(self):
+        return self.thresholds[self.idx]
+
+    def curve(self):
+        """ decimated fpr, tpr for plotting """
+        return self.fpr[self.plot_idxs], self.tpr[self.plot_idxs]
+
+    def point(self):
+        """ fpr, tpr at the operating point """
+        return self.fpr[self.idx], self.tpr[self.idx]
+
+    def __repr__(self):
+        return "Evaluation(auc={:.6f}, threshold={:.6g}, accuracy={:.4f})".format(self.auc, self.threshold, self.accuracy)
+
+
+# this "flashbulb method" was a rough approximate method to combine length and markov model score for gene prediction
+def flashbulb_line(lengths, scores, long_len, short_len, r):
+    """
+    line through the (length, score) medians of the short and long ORFs, and the perpendicular decision boundary
+    crossing it at fraction r of the way from the short to the long median
+    --
+    output: slope of the median line -> float, y intercept of the decision boundary -> float, short and long medians -> tuple x2
+    """
+    lengths = np.asarray(lengths)
+    scores = np.asarray(scores)
+    long, short = lengths > long_len, lengths < short_len
+    (Sx,Sy) = median(lengths[short]), median(scores[short])
+    (Lx,Ly) = median(lengths[long]), median(scores[long])
+
+    # line through the medians, then the perpendicular line through the crossing point
+    m = (Ly-Sy)/(Lx-Sx)
+    b = Ly-m*Lx
+    xcross = Sx + r*(Lx - Sx)
+    ycross = m*xcross+b
+    y_intercept = ycross - (1/m)*xcross
+    return m, y_intercept, (Sx,Sy), (Lx,Ly)
+
+
+def combined_scores(lengths, scores, m, y_intercept):
+    """ combine markov model score and length features into a 'final score': the score's distance above the decision boundary """
+    return np.asarray(scores) - ((-1/m)*np.asarray(lengths) - y_intercept)
@@ -1,107 +1,81 @@
+# extra experiments: ROC curves and AUC of the markov model over a range of each parameter
+# can be run as a script, or through cli.py; matplotlib and pandas are only imported when it runs.
+
 import argparse
-import numpy as np
-from statistics import median
-from sklearn.metrics import roc_curve
-from sklearn.metrics import roc_auc_score
-from sklearn.metrics import accuracy_score
-import matplotlib.pyplot as plt
-from MarkovModel import MarkovModel
-from ORF import ORF, read_fna
-import pandas as pd
-
-# input data
-data=read_fna("data/GCF_000091665.1_ASM9166v1_genomic.fna")
-seq = data[0].sequence
-
-# golden testset
-goldens = pd.read_csv("data/plusgenes-subset.gff", delimiter="\t", header=None)
-
-def check_match(end_idx):
-    stop_idx = end_idx + 3
-    matches = goldens.index[goldens[4] == stop_idx]
-    if len(matches) == 0:
-        return False
-    else:
-        return True
+from genome_cache import read_genome
+from gff import read_gold_set
+from evaluation import Evaluation
+from sweep import Sweep
+from train_model import FNA, GFF
+
+# parameter ranges to sweep over, one at a time with the others at k=5, pseudocount=1, long_len=1400, short_len=50
+longls = [400,800,1000,1200, 1400, 2000]
+shortls = [20,50,70,80,100]
+ks = [3,4,5,6,7]
+pseudos = [0.1,0.5,1,3,5]
+sweeps = [("long_len", longls, "longl", "long_len"),
+          ("short_len", shortls, "shortl", "short_len"),
+          ("k", ks, "k", "k"),
+          ("pseudocount", pseudos, "p", "p")]
 
 def roc_len_score(fig, df_results, var_name, var):
-    fpr, tpr, _ = roc_curve(df_results["matches"], df_results["score"])
-    auc = roc_auc_score(df_results["matches"], df_results["score"])
-    plt.plot(fpr, tpr, label="{} = {}, auc = {}".format(var_name, var, auc))
-    
+    import matplotlib.pyplot as plt
+
+    ev = Evaluation(df_results["matches"], df_results["score"])
+    plt.plot(*ev.curve(), label="{} = {}, auc = {}".format(var_name, var, ev.auc))
+
     plt.xlabel("False Positive Rate")
     plt.ylabel("True Positive Rate")
     plt.title("ROC curves of Length and Markov Scores")
     plt.legend()
 
 def zoomin(fig, xlow, xhigh, ylow, yhigh):
+    import matplotlib.pyplot as plt
+
     plt.xlim(xlow,xhigh)
     plt.ylim(ylow,yhigh)
 
-# range of long lengths
-longls = [400,800,1000,1200, 1400, 2000]
-fig = plt.figure()
-for longl in longls:
-    mm = MarkovModel(k=5, seq=seq, pseudocount=1, long_len=longl)
-    results = mm.results()
-    df_results = pd.DataFrame(results)
-    df_results["matches"] = df_results["end"].apply(lambda x: check_match(int(x)))
-    roc_len_score(fig, df_results, "long_len", longl)
-
-plt.savefig("output/longl_roc.png")
-zoomin(fig, -0.02, 0.15, 0.75, 1.03)
-plt.savefig("output/longl_roc_zoomed.png")
-plt.close()
-
-
-# range of short lengths
-shortls = [20,50,70,80,100]
-fig = plt.figure()
-for shortl in shortls:
-    mm = MarkovModel(k=5, seq=seq, pseudocount=1, short_len=shortl)
-    results = mm.results()
-    df_results = pd.DataFrame(results)
-    df_results["matches"] = df_results["end"].apply(lambda x: check_match(int(x)))
-    roc_len_score(fig, df_results, "short_len", shortl)
-
-plt.savefig("output/shortl_roc.png")
-zoomin(fig, -0.02, 0.15, 0.75, 1.03)
-plt.savefig("output/shortl_roc_zoomed.png")
-plt.close()
-
-
-
-# range of k to try
-ks = [3,4,5,6,7]
-
-fig = plt.figure()
-for k in ks:
-    mm = MarkovModel(k=k, seq=seq, pseudocount=1)
-    results = mm.results()
-    df_results = pd.DataFrame(results)
-    df_results["matches"] = df_results["end"].apply(lambda x: check_match(int(x)))
-    roc_len_score(fig, df_results, "k", k)
-
-plt.savefig("output/k_roc.png")
-zoomin(fig, -0.02, 0.15, 0.75, 1.03)
-plt.savefig("output/k_roc_zoomed.png")
-plt.close()
-
-
-# range of pseudo counts to try
-pseudos = [0.1,0.5,1,3,5]
-
-fig = plt.figure()
-for p in pseudos:
-    mm = MarkovModel(k=5, seq=seq, pseudocount=p)
-    results = mm.results()
-    df_results = pd.DataFrame(results)
-    df_results["matches"] = df_results["end"].apply(lambda x: check_match(int(x)))
-    roc_len_score(fig, df_results, "p", p)
-
-plt.savefig("output/p_roc.png")
-zoomin(fig, -0.02, 0.15, 0.75, 1.03)
-plt.savefig("output/p_roc_zoomed.png")
-plt.close()
-
-
+def run(fna=FNA, gff=GFF, output="output"):
+    """ sweep every parameter, plot the ROC curves of each sweep and return the AUC of every configuration -> pd.DataFrame """
+    import matplotlib.pyplot as plt
+    import pandas as pd
+
+    # input data, read through the packed genome cache (data/*.fna.pack) after the first run
+    data = read_genome(fna)
+    seq = data[0].sequence
+
+    # golden set (our dev set): plus strand CDS of the chromosome, indexed by stop codon
+    goldens = read_gold_set(gff, data[0].seq_id, "+")
+
+    # ORFs are parsed and kmers counted once for all configurations, and gold set matches only depend on the ORFs
+    sweep = Sweep(seq, max_k=max(ks), long_lens=longls)
+    df_results = pd.DataFrame({"start": sweep.orfs.starts, "end": sweep.orfs.ends, "length": sweep.orfs.lengths})
+    df_results["matches"], df_results["gene"] = goldens.label(df_results["end"])
+
+    aucs = []
+    for param, values, filename, label in sweeps:
+        configs = [{param: x} for x in values]
+        aucs.append(sweep.run(configs, df_results["matches"]))
+
+        fig = plt.figure()
+        for config, x in zip(configs, values):
+            df_results["score"] = sweep.scores(**{key: value for key, value in config.items() if key != "short_len"})
+            roc_len_score(fig, df_results, label, x)
+
+        plt.savefig("{}/{}_roc.png".format(output, filename))
+        zoomin(fig, -0.02, 0.15, 0.75, 1.03)
+        plt.savefig("{}/{}_roc_zoomed.png".format(output, filename))
+        plt.close()
+
+    return pd.concat(aucs, ignore_index=True)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="ROC curves and AUC of the markov model over a range of each parameter")
+    parser.add_argument("-fna", default=FNA, help="genome FASTA file, the first record is used")
+    parser.add_argument("-gff", default=GFF, help="GFF3 annotation the gold set is read from")
+    parser.add_argument("-output", default="output", help="directory the plots are written to")
+    args = parser.parse_args(argv)
+    print(run(args.fna, args.gff, args.output))
+
+if __name__ == "__main__":
+    main()
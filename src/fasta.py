@@ -0,0 +1,89 @@
+# streaming FASTA reader
+# records are read one at a time, so memory is proportional to the largest record rather than the whole file.
+# gzipped files (i.e. .fna.gz) are read transparently.
+
+import gzip
+import numpy as np
+from encoding import BASE_CODES
+from profiling import stage
+
+# normalize sequence bytes in bulk: upper case ACGT, every other base becomes T (as in the original read_fna)
+NORMALIZE = bytearray(b"T" * 256)
+for base in b"ACGT":
+    NORMALIZE[base] = base
+    NORMALIZE[base + 32] = base
+NORMALIZE = bytes(NORMALIZE)
+WHITESPACE = b" \t\r\n\v\f"
+
+# organize input data into a class
+class GenomeData:
+    __slots__ = ("seq_name", "sequence", "seq_len")
+
+    def __init__(self, seq_name=None, sequence="", seq_len=0):
+        self.seq_name = seq_name
+        self.sequence = sequence
+        self.seq_len = seq_len
+
+    @property
+    def seq_id(self):
+        """ sequence id, i.e. the header up to the first space, as used in the seqid column of GFF files """
+        return self.seq_name.lstrip(">").split()[0] if self.seq_name else None
+
+    def __repr__(self):
+        return "GenomeData({}, length {})".format(self.seq_name, self.seq_len)
+
+
+def open_maybe_gzip(filename):
+    """ open a possibly gzipped file (FASTA, GFF3, ...) for binary reading """
+    with open(filename, "rb") as f:
+        magic = f.read(2)
+    if magic == b"\x1f\x8b":
+        return gzip.open(filename, "rb")
+    return open(filename, "rb")
+
+
+def make_record(name, chunks, encoded):
+    if encoded:
+        sequence = BASE_CODES[np.frombuffer(chunks, dtype=np.uint8)]
+    else:
+        sequence = chunks.decode("ascii")
+    return GenomeData(name, sequence, len(sequence))
+
+
+def iter_fasta(filename, encoded=False):
+    """
+    yield the records of a FASTA file one at a time
+    --
+    input: path to .fna or .fna.gz -> str, encoded -> bool
+    output: records with the sequence as a string, or as an array of base codes (see encoding.py) if encoded -> GenomeData
+    """
+    with open_maybe_gzip(filename) as f:
+        yield from iter_records(f, encoded, filename)
+
+
+def iter_records(lines, encoded=False, source="FASTA"):
+    """ yield the records of FASTA formatted lines of bytes, i.e. an open file or the lines of an in-memory payload """
+    name = None
+    chunks = bytearray()
+    for line in lines:
+        if line[:1] == b">":
+            if name is not None:
+                yield make_record(name, chunks, encoded)
+            name = line.strip().decode()
+            chunks = bytearray()
+        elif name is None:
+            if line.strip():
+                raise ValueError("{}: sequence data before the first FASTA header".format(source))
+        else:
+            chunks += line.translate(NORMALIZE, WHITESPACE)
+
+    if name is not None:
+        yield make_record(name, chunks, encoded)
+
+
+def read_fna(filename, encoded=False):
+    """ read every record of a FASTA file into a list """
+    with stage("read_fasta") as profile:
+        records = list(iter_fasta(filename, encoded))
+        profile.count(records=len(records), bases=sum(record.seq_len for record in records))
+    return records
@@ -0,0 +1,111 @@
+# packed genome cache
+# a FASTA file is packed once into a directory holding the uint8 base codes of all its records back to back
+# (codes.bin) and an index (index.json) with record names, offsets and a content hash.
+# later runs open codes.bin with np.memmap, so startup doesn't parse any text and
+# processes reading the same genome share the same pages.
+
+import hashlib
+import json
+import os
+import numpy as np
+from fasta import GenomeData, iter_fasta
+from profiling import stage
+
+PACK_SUFFIX = ".pack"
+
+
+class PackedGenome:
+    __slots__ = ("path", "codes", "names", "starts", "ends", "digest")
+
+    def __init__(self, path):
+        self.path = path
+        with open(os.path.join(path, "index.json")) as f:
+            index = json.load(f)
+        self.names = index["names"]
+        self.starts = np.array(index["starts"], dtype=np.int64)
+        self.ends = np.array(index["ends"], dtype=np.int64)
+        self.digest = index["sha256"]
+        if index["length"]:
+            self.codes = np.memmap(os.path.join(path, "codes.bin"), dtype=np.uint8, mode="r", shape=(index["length"],))
+        else:
+            self.codes = np.zeros(0, dtype=np.uint8)
+
+    def __len__(self):
+        return len(self.names)
+
+    def __getitem__(self, i):
+        """ base codes of the i-th record, a view into the mapped file """
+        return self.codes[self.starts[i]:self.ends[i]]
+
+    def records(self):
+        """ records in the same form as read_fna(..., encoded=True), backed by the mapped file """
+        return [GenomeData(name, self[i], int(self.ends[i] - self.starts[i])) for i, name in enumerate(self.names)]
+
+    def __repr__(self):
+        return "PackedGenome({}, {} records, {} bases, sha256 {})".format(self.path, len(self), len(self.codes), self.digest[:12])
+
+
+def source_stamp(filename):
+    stat = os.stat(filename)
+    return {"source": os.path.abspath(filename), "size": stat.st_size, "mtime": stat.st_mtime}
+
+
+def pack_fasta(filename, path=None):
+    """
+    pack a FASTA file into a genome cache directory, streaming one record at a time
+    --
+    input: path to .fna or .fna.gz -> str, cache directory (defaults to <filename>.pack) -> str
+    output: the opened cache -> PackedGenome
+    """
+    path = path or filename + PACK_SUFFIX
+    os.makedirs(path, exist_ok=True)
+    digest = hashlib.sha256()
+    names, starts, ends = [], [], []
+    length = 0
+
+    # write to temporary files and rename, so a reader never sees a half written cache
+    with open(os.path.join(path, "codes.bin.tmp"), "wb") as f:
+        for record in iter_fasta(filename, encoded=True):
+            codes = record.sequence.tobytes()
+            f.write(codes)
+            digest.update(codes)
+            names.append(record.seq_name)
+            starts.append(length)
+            length += len(codes)
+            ends.append(length)
+
+    index = {"names": names, "starts": starts, "ends": ends, "length": length, "sha256": digest.hexdigest()}
+    index.update(source_stamp(filename))
+    with open(os.path.join(path, "index.json.tmp"), "w") as f:
+        json.dump(index, f)
+    os.replace(os.path.join(path, "codes.bin.tmp"), os.path.join(path, "codes.bin"))
+    os.replace(os.path.join(path, "index.json.tmp"), os.path.join(path, "index.json"))
+
+    return PackedGenome(path)
+
+
+def is_fresh(filename, path):
+    """ whether the cache at path was packed from the current version of filename """
+    try:
+        with open(os.path.join(path, "index.json")) as f:
+            index = json.load(f)
+    except (OSError, ValueError):
+        return False
+    stamp = source_stamp(filename)
+    return index.get("size") == stamp["size"] and index.get("mtime") == stamp["mtime"]
+
+
+def load_genome(filename, path=None):
+    """ open the packed cache of a FASTA file, packing it first if it's missing or out of date """
+    path = path or filename + PACK_SUFFIX
+    if not is_fresh(filename, path):
+        return pack_fasta(filename, path)
+    return PackedGenome(path)
+
+
+def read_genome(filename, cache=True):
+    """ drop-in for read_fna(filename, encoded=True) that goes through the packed cache """
+    with stage("read_genome") as profile:
+        records = list(iter_fasta(filename, encoded=True)) if not cache else load_genome(filename).records()
+        profile.count(records=len(records), bases=sum(record.seq_len for record in records))
+    return records
@@ -0,0 +1,112 @@
+# GFF3 annotation loader and gold set index
+# the annotation is streamed line by line and filtered to CDS features of one sequence and strand.
+# the gold set is indexed by stop codon coordinate once, so labeling every ORF is a single searchsorted.
+
+import io
+import numpy as np
+from fasta import open_maybe_gzip
+from profiling import stage
+
+GFF_COLUMNS = ["seqid", "source", "type", "start", "end", "score", "strand", "phase", "attributes"]
+
+
+class GffFeature:
+    __slots__ = ("seqid", "type", "start", "end", "strand", "attributes")
+
+    def __init__(self, seqid, type, start, end, strand, attributes):
+        self.seqid = seqid
+        self.type = type
+        self.start = start
+        self.end = end
+        self.strand = strand
+        self.attributes = attributes
+
+    def attribute(self, key):
+        """ value of a column 9 attribute (i.e. ID, locus_tag), None if it's missing """
+        for field in self.attributes.split(";"):
+            name, _, value = field.partition("=")
+            if name == key:
+                return value
+        return None
+
+    def gene_id(self):
+        return self.attribute("locus_tag") or self.attribute("ID")
+
+
+def iter_gff(filename, types=("CDS",), seqid=None, strand=None):
+    """
+    stream the features of a (possibly gzipped) GFF3 file
+    --
+    input: path -> str, feature types to keep (None for all) -> tuple of str, seqid and strand to keep (None for all) -> str
+    output: features with 1-based, inclusive start and end coordinates -> GffFeature
+    """
+    with io.TextIOWrapper(open_maybe_gzip(filename)) as f:
+        for line in f:
+            if line.startswith("##FASTA"):
+                break
+            if line.startswith("#") or not line.strip():
+                continue
+            fields = line.rstrip("\n").split("\t")
+            if types is not None and fields[2] not in types:
+                continue
+            if seqid is not None and fields[0] != seqid:
+                continue
+            if strand is not None and fields[6] != strand:
+                continue
+            yield GffFeature(fields[0], fields[2], int(fields[3]), int(fields[4]), fields[6], fields[8])
+
+
+class GoldSet:
+    """
+    gold set genes indexed by the 1-based coordinate of their stop codon: the end of plus strand genes and the start of minus strand genes.
+    a plus strand ORF [start, end) (0-based, stop codon excluded) matches a gene ending at end+3,
+    a minus strand ORF matches a gene starting at start-2
+    """
+    def __init__(self, stops, genes, strands=None):
+        stops = np.asarray(stops, dtype=np.int64)
+        strands = np.ones(len(stops), dtype=np.int8) if strands is None else np.asarray(strands, dtype=np.int8)
+        keys = stop_keys(stops, strands)
+        order = np.argsort(keys, kind="stable")
+        self.keys = keys[order]
+        self.genes = np.asarray(genes, dtype=object)[order]
+
+    def __len__(self):
+        return len(self.keys)
+
+    def label(self, ends, starts=None, strands=None):
+        """
+        label ORFs by whether their stop codon is a gold set gene's stop codon
+        --
+        input: ORF end offsets -> np.ndarray, and for ORFs on both strands their start offsets and strands (1 or -1) -> np.ndarray x2
+        output: match of every ORF -> np.ndarray of bool, matched gene id (None for no match) -> np.ndarray of object
+        """
+        with stage("label", orfs=len(ends)):
+            ends = np.asarray(ends, dtype=np.int64)
+            if strands is None:
+                keys = stop_keys(ends + 3, np.ones(len(ends), dtype=np.int8))
+            else:
+                strands = np.asarray(strands)
+                keys = stop_keys(np.where(strands > 0, ends + 3, np.asarray(starts, dtype=np.int64) - 2), strands)
+
+            if len(self.keys) == 0:
+                return np.zeros(len(keys), dtype=bool), np.full(len(keys), None, dtype=object)
+            idxs = np.minimum(np.searchsorted(self.keys, keys), len(self.keys) - 1)
+            matches = self.keys[idxs] == keys
+            return matches, np.where(matches, self.genes[idxs], None)
+
+
+def stop_keys(stops, strands):
+    """ one sortable key per (stop coordinate, strand) """
+    return stops*2 + (strands < 0)
+
+
+def read_gold_set(filename, seqid=None, strand="+"):
+    """ CDS features of one sequence and strand (None for both strands) of a GFF3 file, as a gold set """
+    with stage("gold_set") as profile:
+        stops, genes, strands = [], [], []
+        for feature in iter_gff(filename, ("CDS",), seqid, strand):
+            stops.append(feature.end if feature.strand == "+" else feature.start)
+            genes.append(feature.gene_id())
+            strands.append(1 if feature.strand == "+" else -1)
+        profile.count(genes=len(genes))
+        return GoldSet(stops, genes, strands)
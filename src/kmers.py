@@ -0,0 +1,311 @@
+# kmer count tables
+# counts are kept in dense numpy arrays of size 4^k indexed by kmer code (see encoding.py),
+# with Counter-like lookups by kmer string so the MLE approximations can keep using them as before.
+# for large k, where a dense table would be huge and mostly empty, only the observed kmers are kept,
+# as sorted code and count arrays looked up with searchsorted (SparseKmerCounts). table_class picks one, from the
+# number of counted positions, so that every table of a model is counted with the same backend.
+
+import numpy as np
+from encoding import INVALID, encode_many, kmer_code, kmer_string, prefix_codes, range_coverage, rolling_codes, suffix_codes
+
+
+class KmerCounts:
+    def __init__(self, k, counts=None):
+        self.k = k
+        if counts is None:
+            counts = np.zeros(4**k, dtype=np.int64)
+        self.counts = counts
+
+    @classmethod
+    def from_ranges(cls, codes, starts, ends, k):
+        """ count every kmer lying within the [start, end) ranges of an encoded buffer, in one pass over the buffer """
+        kmers = rolling_codes(codes, k)
+        coverage = range_coverage(starts, ends, k, len(kmers))
+        keep = (coverage > 0) & (kmers >= 0)
+        if len(kmers) and coverage.max() > 1:
+            # overlapping ranges (i.e. orfs in different reading frames) count shared kmers once per range
+            counts = np.bincount(kmers[keep], weights=coverage[keep], minlength=4**k).astype(np.int64)
+        else:
+            counts = np.bincount(kmers[keep], minlength=4**k).astype(np.int64)
+        return cls(k, counts)
+
+    @classmethod
+    def from_codes(cls, kmers, k):
+        """ count a given array of kmer codes, negative (invalid) codes are skipped """
+        kmers = np.asarray(kmers, dtype=np.int64)
+        return cls(k, np.bincount(kmers[kmers >= 0], minlength=4**k).astype(np.int64))
+
+    def marginalize(self, tail_codes=None):
+        """
+        derive the (k-1)mer counts by summing out the last base of each kmer
+        --
+        input: codes of the (k-1)mers that are not followed by another base, i.e. the last (k-1)mer of each sequence -> np.ndarray
+        output: (k-1)mer counts -> KmerCounts
+        """
+        counts = self.counts.reshape(-1, 4).sum(axis=1)
+        if tail_codes is not None:
+            counts += KmerCounts.from_codes(tail_codes, self.k - 1).counts
+        return KmerCounts(self.k - 1, counts)
+
+    def lookup(self, kmers):
+        """ vectorized counts of an array of kmer codes, 0 for invalid codes """
+        kmers = np.asarray(kmers, dtype=np.int64)
+        return np.where(kmers >= 0, self.counts[np.maximum(kmers, 0)], 0)
+
+    def code(self, key):
+        """ kmer code of a kmer string (or code), -1 if it can't be in this table """
+        if isinstance(key, str):
+            return kmer_code(key) if len(key) == self.k else -1
+        return int(key)
+
+    def total(self):
+        return int(self.counts.sum())
+
+    # Counter-like interface: only kmers that were actually observed are "in" the table
+    def __getitem__(self, key):
+        code = self.code(key)
+        return int(self.counts[code]) if code >= 0 else 0
+
+    def __contains__(self, key):
+        code = self.code(key)
+        return code >= 0 and self.counts[code] > 0
+
+    def __len__(self):
+        return int(np.count_nonzero(self.counts))
+
+    def observed(self):
+        return np.flatnonzero(self.counts)
+
+    def keys(self):
+        return [kmer_string(int(x), self.k) for x in self.observed()]
+
+    def values(self):
+        return [int(x) for x in self.counts[self.observed()]]
+
+    def items(self):
+        return zip(self.keys(), self.values())
+
+    def __iter__(self):
+        return iter(self.keys())
+
+    def dense(self):
+        return self
+
+    def sparse(self):
+        """ the same counts as a SparseKmerCounts """
+        observed = self.observed()
+        return SparseKmerCounts(self.k, observed, self.counts[observed])
+
+    def __add__(self, other):
+        if isinstance(other, SparseKmerCounts):
+            return self.sparse() + other
+        return KmerCounts(self.k, self.counts + other.counts)
+
+    def __sub__(self, other):
+        if isinstance(other, SparseKmerCounts):
+            return self.sparse() - other
+        return KmerCounts(self.k, self.counts - other.counts)
+
+    def __eq__(self, other):
+        if isinstance(other, SparseKmerCounts):
+            return other == self
+        return isinstance(other, KmerCounts) and self.k == other.k and np.array_equal(self.counts, other.counts)
+
+    def __repr__(self):
+        return "KmerCounts(k={}, observed={}, total={})".format(self.k, len(self), self.total())
+
+
+def merge_counts(codes, counts):
+    """ sorted unique codes and summed counts of (possibly repeated) codes, dropping codes whose count sums to zero """
+    unique, inverse = np.unique(codes, return_inverse=True)
+    summed = np.bincount(inverse, weights=counts, minlength=len(unique)).astype(np.int64)
+    nonzero = summed != 0
+    return unique[nonzero], summed[nonzero]
+
+
+class SparseKmerCounts(KmerCounts):
+    """ counts of the observed kmers only, as sorted kmer codes and their counts: memory grows with the data, not with 4^k """
+    def __init__(self, k, codes=None, counts=None):
+        self.k = k
+        self.codes = np.zeros(0, dtype=np.int64) if codes is None else np.asarray(codes, dtype=np.int64)
+        self.counts = np.zeros(0, dtype=np.int64) if counts is None else np.asarray(counts, dtype=np.int64)
+
+    @classmethod
+    def from_ranges(cls, codes, starts, ends, k):
+        kmers = rolling_codes(codes, k)
+        coverage = range_coverage(starts, ends, k, len(kmers))
+        keep = (coverage > 0) & (kmers >= 0)
+        return cls(k, *merge_counts(kmers[keep], coverage[keep]))
+
+    @classmethod
+    def from_codes(cls, kmers, k):
+        kmers = np.asarray(kmers, dtype=np.int64)
+        kmers = kmers[kmers >= 0]
+        return cls(k, *merge_counts(kmers, np.ones(len(kmers))))
+
+    def marginalize(self, tail_codes=None):
+        codes, counts = self.codes >> 2, self.counts
+        if tail_codes is not None:
+            tail_codes = np.asarray(tail_codes, dtype=np.int64)
+            tail_codes = tail_codes[tail_codes >= 0]
+            codes, counts = np.concatenate((codes, tail_codes)), np.concatenate((counts, np.ones(len(tail_codes), dtype=np.int64)))
+        return SparseKmerCounts(self.k - 1, *merge_counts(codes, counts))
+
+    def find(self, kmers):
+        """ index of each kmer code in codes, and whether it's there at all """
+        kmers = np.asarray(kmers, dtype=np.int64)
+        if len(self.codes) == 0:
+            return np.zeros(kmers.shape, dtype=np.int64), np.zeros(kmers.shape, dtype=bool)
+        idxs = np.searchsorted(self.codes, kmers).clip(max=len(self.codes) - 1)
+        return idxs, self.codes[idxs] == kmers
+
+    def lookup(self, kmers):
+        idxs, found = self.find(kmers)
+        return np.where(found, self.counts[idxs], 0)
+
+    def __getitem__(self, key):
+        code = self.code(key)
+        return int(self.lookup(code)) if code >= 0 else 0
+
+    def __contains__(self, key):
+        return self[key] > 0
+
+    def __len__(self):
+        return int(np.count_nonzero(self.counts))
+
+    def observed(self):
+        return self.codes[self.counts > 0]
+
+    def values(self):
+        return [int(x) for x in self.counts[self.counts > 0]]
+
+    def sparse(self):
+        return self
+
+    def dense(self):
+        """ the same counts as a dense KmerCounts """
+        counts = np.zeros(4**self.k, dtype=np.int64)
+        counts[self.codes] = self.counts
+        return KmerCounts(self.k, counts)
+
+    def __add__(self, other):
+        other = other.sparse()
+        return SparseKmerCounts(self.k, *merge_counts(np.concatenate((self.codes, other.codes)), np.concatenate((self.counts, other.counts))))
+
+    def __sub__(self, other):
+        other = other.sparse()
+        return SparseKmerCounts(self.k, *merge_counts(np.concatenate((self.codes, other.codes)), np.concatenate((self.counts, -other.counts))))
+
+    def __eq__(self, other):
+        if not isinstance(other, KmerCounts):
+            return False
+        other = other.sparse()
+        return self.k == other.k and np.array_equal(self.codes, other.codes) and np.array_equal(self.counts, other.counts)
+
+    def __repr__(self):
+        return "SparseKmerCounts(k={}, observed={}, total={})".format(self.k, len(self), self.total())
+
+
+class SparseTable:
+    """
+    values of a sorted set of kmer codes, indexed like a dense table (table[codes]) for a sparse model.
+    codes that aren't in the table back off to the table of their first k-1 bases (code >> 2) if there is one,
+    otherwise to the default, which is also the value of invalid (-1) codes
+    """
+    def __init__(self, codes, values, default, backoff=None):
+        self.codes = np.asarray(codes, dtype=np.int64)
+        self.values = np.asarray(values, dtype=np.float64)
+        self.default = float(default)
+        self.backoff = backoff
+
+    def __getitem__(self, kmers):
+        kmers = np.asarray(kmers, dtype=np.int64)
+        if self.backoff is not None:
+            fallback = self.backoff[kmers >> 2]
+        else:
+            fallback = self.default
+        if len(self.codes) == 0:
+            return np.broadcast_to(fallback, kmers.shape).astype(np.float64)
+        idxs = np.searchsorted(self.codes, kmers).clip(max=len(self.codes) - 1)
+        return np.where(self.codes[idxs] == kmers, self.values[idxs], fallback)
+
+    def __sub__(self, other):
+        """ table of the differences of two tables' values at every code, i.e. of their log likelihood ratio """
+        codes = np.union1d(self.codes, other.codes)
+        backoff = None if self.backoff is None else self.backoff - other.backoff
+        return SparseTable(codes, self[codes] - other[codes], self.default - other.default, backoff)
+
+    def __len__(self):
+        return len(self.codes)
+
+    def __repr__(self):
+        return "SparseTable(entries={}, backoff={})".format(len(self), self.backoff is not None)
+
+
+# dense tables up to this size are always fine, i.e. k+1 <= 8 for k <= 7 as swept in extra.py (0.5 MB of int64)
+DENSE_MAX = 4**8
+
+
+def table_class(k, n):
+    """ count table backend for kmers of n positions: sparse when a dense table would be large and mostly empty """
+    return SparseKmerCounts if 4**k > DENSE_MAX and 4**k > 2*n else KmerCounts
+
+
+def ranges_table_class(k, starts, ends):
+    """ count table backend of a model's tables, from the number of positions of its [start, end) training ranges """
+    return table_class(k+1, int(np.sum(np.asarray(ends, dtype=np.int64) - np.asarray(starts, dtype=np.int64))))
+
+
+def tail_codes(codes, starts, ends, k):
+    """
+    codes of the kmers of the [start, end) ranges that aren't the prefix of a counted k+1mer, i.e. the last kmer of
+    each range and kmers followed by an invalid base. adding these to the marginalized k+1mer counts gives the kmer counts
+    """
+    tails = [suffix_codes(codes, starts, ends, k)]
+    before_invalid = np.flatnonzero(codes[k:] == INVALID)
+    if len(before_invalid):
+        coverage = range_coverage(starts, ends, k+1, max(len(codes) - k, 0))
+        inside = before_invalid[coverage[before_invalid] > 0]
+        tails.append(np.repeat(prefix_codes(codes, inside, inside + k, k), coverage[inside]))
+    return np.concatenate(tails)
+
+
+def count_kmer_pair(codes, starts, ends, k, table=None):
+    """
+    count kmers and k+1mers of the [start, end) ranges of an encoded buffer.
+    only the k+1mers are counted, the kmer counts are derived from them by marginalization
+    --
+    input: base codes -> np.ndarray, range offsets -> np.ndarray, np.ndarray, k -> int, backend (default ranges_table_class) -> type
+    output: kmer counts, k+1mer counts -> KmerCounts, KmerCounts
+    """
+    starts = np.asarray(starts, dtype=np.int64)
+    ends = np.asarray(ends, dtype=np.int64)
+    table = table or ranges_table_class(k, starts, ends)
+    kponemer_counts = table.from_ranges(codes, starts, ends, k+1)
+    return kponemer_counts.marginalize(tail_codes(codes, starts, ends, k)), kponemer_counts
+
+
+def count_orders(codes, starts, ends, max_k, min_k=1, table=None):
+    """
+    counts of every order from min_k to max_k+1 of the [start, end) ranges of an encoded buffer.
+    only the max_k+1mers are counted, each lower order is derived from the one above it by marginalization
+    --
+    output: kmer counts keyed by k -> dict of KmerCounts
+    """
+    starts = np.asarray(starts, dtype=np.int64)
+    ends = np.asarray(ends, dtype=np.int64)
+    table = table or ranges_table_class(max_k, starts, ends)
+    counts = {max_k+1: table.from_ranges(codes, starts, ends, max_k+1)}
+    for k in range(max_k, min_k-1, -1):
+        counts[k] = counts[k+1].marginalize(tail_codes(codes, starts, ends, k))
+    return counts
+
+
+def count_sequences(seqs, k):
+    """ kmer and k+1mer counts of a list of sequences """
+    return count_kmer_pair(*encode_many(seqs), k)
+
+
+def count_starts(codes, starts, ends, k, table=None):
+    """ counts of the first kmer of each [start, end) range, with the backend of the model's other tables if given """
+    return (table or table_class(k, len(starts))).from_codes(prefix_codes(codes, starts, ends, k), k)
@@ -0,0 +1,113 @@
+# scoring every markov order in a single pass
+# the models of all orders share one count at the largest order (see sweep.Sweep, kmers.count_orders), and they share
+# the genome's kmer codes as well: the code of the k+1mer at a position is the code of the max_k+1mer there shifted
+# right, valid as long as the run of ACGT bases starting there is at least k+1 long. so the genome is rolled once, and
+# each order only costs a table lookup and a cumulative sum per position, like a single k run.
+
+import numpy as np
+from encoding import INVALID
+
+
+def valid_runs(codes):
+    """ number of ACGT bases from each position up to the next invalid base (or the end of the buffer) """
+    n = len(codes)
+    positions = np.arange(n)
+    next_invalid = np.where(codes == INVALID, positions, n)
+    next_invalid = np.minimum.accumulate(next_invalid[::-1])[::-1]
+    return next_invalid - positions
+
+
+def padded_codes(codes, k):
+    """ codes of the kmers starting at every position of a buffer, reading past its end as A and ignoring invalid bases """
+    n = len(codes)
+    padded = np.concatenate((codes, np.zeros(k - 1, dtype=codes.dtype))) & 3
+    kmers = np.zeros(n, dtype=np.int64)
+    for j in range(k):
+        kmers <<= 2
+        kmers |= padded[j:j+n]
+    return kmers
+
+
+class MultiOrderModel:
+    """
+    markov models of several orders trained on the same counts, scored together.
+    scores() gives the score of each order, the same as each model's own score_ranges, and mixture_scores() the
+    interpolated model: at every position the probabilities of the orders are mixed with fixed weights
+    """
+    def __init__(self, models, weights=None, orfs=None):
+        self.models = sorted(models, key=lambda mm: mm.k)
+        self.orders = [mm.k for mm in self.models]
+        self.max_k = self.orders[-1]
+        weights = np.ones(len(self.models)) if weights is None else np.asarray(weights, dtype=np.float64)
+        self.weights = weights / weights.sum()
+        self.orfs = orfs
+
+    def order_codes(self, codes, starts, ends):
+        """
+        yields, for each order, its model, the k+1mer codes of every position and the prefix codes of every range,
+        all derived from one rolling pass over the buffer at the largest order
+        """
+        runs = valid_runs(codes)
+        kmers = padded_codes(codes, self.max_k + 1)
+        start_kmers = kmers[np.minimum(starts, max(len(kmers) - 1, 0))] if len(kmers) else np.zeros(len(starts), dtype=np.int64)
+        start_runs = runs[np.minimum(starts, max(len(runs) - 1, 0))] if len(runs) else np.zeros(len(starts), dtype=np.int64)
+
+        for mm in self.models:
+            k = mm.k
+            n = max(len(codes) - k, 0)
+            positions = np.where(runs[:n] > k, kmers[:n] >> 2*(self.max_k - k), -1)
+            prefixes = np.where((ends - starts >= k) & (start_runs >= k), start_kmers >> 2*(self.max_k + 1 - k), -1)
+            yield mm, positions, prefixes
+
+    def range_sums(self, k, position_scores, starts, ends):
+        """ sums of the position scores of each range's k+1mers, from start+1 to end-k-1 as in MarkovModel.score_ranges """
+        cumulative = np.concatenate(([0.0], np.cumsum(position_scores)))
+        first = np.minimum(starts + 1, len(cumulative) - 1)
+        last = np.clip(ends - k, first, len(cumulative) - 1)
+        return cumulative[last] - cumulative[first]
+
+    def scores(self, codes=None, starts=None, ends=None):
+        """
+        score every [start, end) range under every order, defaults to the ORFs of the genome the model was built on
+        --
+        output: log likelihood ratio of each range (rows) under each order (columns, in self.orders) -> np.ndarray
+        """
+        if codes is None:
+            codes, starts, ends = self.orfs.buffer_ranges()
+        starts = np.asarray(starts, dtype=np.int64)
+        ends = np.asarray(ends, dtype=np.int64)
+
+        scores = np.empty((len(starts), len(self.models)))
+        for i, (mm, positions, prefixes) in enumerate(self.order_codes(codes, starts, ends)):
+            scores[:, i] = mm.log_ratio_start[prefixes] + self.range_sums(mm.k, mm.log_ratio[positions], starts, ends)
+        return scores
+
+    def mixture_scores(self, codes=None, starts=None, ends=None):
+        """
+        score every [start, end) range under the interpolated model, i.e. log(sum_k w_k P_k) - log(sum_k w_k Q_k)
+        of the start and of each k+1mer. the k+1mers are the positions of the largest order, from start+1 to end-max_k-1,
+        and every order predicts the same base there: the last base of the largest order's k+1mer at i is the last base
+        of an order k's k+1mer at i+max_k-k
+        --
+        output: log likelihood ratio of each range -> np.ndarray
+        """
+        if codes is None:
+            codes, starts, ends = self.orfs.buffer_ranges()
+        starts = np.asarray(starts, dtype=np.int64)
+        ends = np.asarray(ends, dtype=np.int64)
+
+        n = max(len(codes) - self.max_k, 0)
+        p, q = np.zeros(n), np.zeros(n)
+        p_start, q_start = np.zeros(len(starts)), np.zeros(len(starts))
+        for w, (mm, positions, prefixes) in zip(self.weights, self.order_codes(codes, starts, ends)):
+            shift = self.max_k - mm.k
+            p += w * np.exp(mm.log_p[positions[shift:shift+n]])
+            q += w * np.exp(mm.log_q[positions[shift:shift+n]])
+            p_start += w * np.exp(mm.log_p_start[prefixes])
+            q_start += w * np.exp(mm.log_q_start[prefixes])
+
+        with np.errstate(divide="ignore", invalid="ignore"):
+            return np.log(p_start) - np.log(q_start) + self.range_sums(self.max_k, np.log(p) - np.log(q), starts, ends)
+
+    def __repr__(self):
+        return "MultiOrderModel(orders={}, weights={})".format(self.orders, np.round(self.weights, 3).tolist())
@@ -0,0 +1,106 @@
+# parallel ORF scoring in a process pool
+# the encoded buffer, the ORF ranges and the log likelihood ratio tables are put in shared memory once, when the pool
+# starts. ORFs are sorted by position and split into chunks of whole ORFs. each task is just a (lo, hi) slice of that
+# order: the worker scores the ORFs of its slice from the prefix sums of the stretch of buffer they span, and writes
+# the scores into a shared output array at their own indices. the result doesn't depend on the order tasks finish in.
+# sparse models' tables (kmers.SparseTable) are sent to each worker once, when it starts, instead of being shared.
+
+import os
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+import numpy as np
+
+# state of a pool worker: the shared arrays it's attached to and a bare model holding k
+_worker = {}
+
+
+class SharedArrays:
+    """ numpy arrays copied into named shared memory blocks, attachable from other processes by their spec """
+    def __init__(self, arrays):
+        self.blocks = []
+        self.arrays = {}
+        self.spec = {}
+        for name, array in arrays.items():
+            array = np.ascontiguousarray(array)
+            block = shared_memory.SharedMemory(create=True, size=max(array.nbytes, 1))
+            self.blocks.append(block)
+            self.arrays[name] = np.ndarray(array.shape, array.dtype, buffer=block.buf)
+            self.arrays[name][...] = array
+            self.spec[name] = (block.name, array.shape, array.dtype.str)
+
+    @staticmethod
+    def attach(spec):
+        """ views of the arrays of a spec, and the blocks to keep open while they're used """
+        blocks, arrays = [], {}
+        for name, (block_name, shape, dtype) in spec.items():
+            block = shared_memory.SharedMemory(name=block_name)
+            blocks.append(block)
+            arrays[name] = np.ndarray(shape, np.dtype(dtype), buffer=block.buf)
+        return blocks, arrays
+
+    def close(self):
+        self.arrays = {}
+        for block in self.blocks:
+            block.close()
+            block.unlink()
+        self.blocks = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def init_worker(spec, k, tables=None):
+    """ pool initializer: attach to the shared arrays once per worker """
+    from MarkovModel import MarkovModel
+    blocks, arrays = SharedArrays.attach(spec)
+    if tables is not None:
+        arrays["start_table"], arrays["table"] = tables
+    mm = MarkovModel.__new__(MarkovModel)
+    mm.k = k
+    _worker.update(blocks=blocks, arrays=arrays, mm=mm)
+
+
+def score_chunk(task):
+    """ worker: score the ORFs order[lo:hi] over the stretch of buffer they span, writing into the shared scores """
+    lo, hi = task
+    a = _worker["arrays"]
+    idxs = a["order"][lo:hi]
+    starts, ends = a["starts"][idxs], a["ends"][idxs]
+    first, last = starts.min(), ends.max()
+    a["scores"][idxs] = _worker["mm"].score_ranges(a["codes"][first:last], starts - first, ends - first,
+                                                   a["start_table"], a["table"])
+    return hi - lo
+
+
+def chunk_bounds(n, chunks):
+    """ (lo, hi) bounds of splitting n items into about the given number of contiguous chunks """
+    bounds = np.linspace(0, n, min(chunks, n) + 1).astype(np.int64)
+    return [(int(lo), int(hi)) for lo, hi in zip(bounds[:-1], bounds[1:]) if hi > lo]
+
+
+def score_orfs(mm, orfs, processes=None, chunks_per_process=8):
+    """
+    score every ORF of a parsed genome in a process pool, with the log likelihood ratio tables of a model
+    --
+    input: model -> MarkovModel, parsed genome -> ORF, pool size (None = all cores) -> int, tasks per worker -> int
+    output: score of every ORF, in ORF order -> np.ndarray
+    """
+    processes = processes or os.cpu_count()
+    codes, starts, ends = orfs.buffer_ranges()
+    if len(starts) == 0:
+        return np.zeros(0)
+    order = np.argsort(starts, kind="stable")
+    arrays = {"codes": codes, "starts": starts, "ends": ends, "order": order, "scores": np.zeros(len(starts))}
+    tables = (mm.log_ratio_start, mm.log_ratio)
+    if not mm.sparse:
+        arrays["start_table"], arrays["table"] = tables
+        tables = None
+
+    with SharedArrays(arrays) as shared:
+        with ProcessPoolExecutor(processes, initializer=init_worker, initargs=(shared.spec, mm.k, tables)) as pool:
+            for _ in pool.map(score_chunk, chunk_bounds(len(order), processes * chunks_per_process)):
+                pass
+        return shared.arrays["scores"].copy()
@@ -0,0 +1,137 @@
+# streaming whole-genome scoring pipeline
+#   FASTA records -> ORF candidates -> batched scoring -> thresholding -> GFF3 / TSV, written as we go
+# only one record is held at a time, and each batch of ORFs is scored over just the stretch of the record it spans,
+# so peak memory is bounded by the largest record (its bases and ORF index) plus the batch size, not the input size.
+
+import argparse
+import sys
+import time
+import numpy as np
+from MarkovModel import MarkovModel
+from ORF import ORF
+from fasta import iter_fasta
+
+
+def score_batches(mm, orfs, batch_size=10000):
+    """
+    score the ORFs of one record in batches of neighbouring ORFs
+    --
+    input: model -> MarkovModel, parsed record -> ORF, ORFs per batch -> int
+    output: yields ORF indices of the batch (in buffer order) and their scores -> np.ndarray, np.ndarray
+    """
+    buffer, starts, ends = orfs.buffer_ranges()
+    order = np.argsort(starts, kind="stable")
+    for i in range(0, len(order), batch_size):
+        idxs = order[i:i+batch_size]
+        lo, hi = starts[idxs].min(), ends[idxs].max()
+        yield idxs, mm.score_ranges(buffer[lo:hi], starts[idxs] - lo, ends[idxs] - lo)
+
+
+def gene_calls(mm, records, threshold=0.0, min_len=0, batch_size=10000, both_strands=True):
+    """
+    stream gene calls from FASTA records: ORFs scoring above threshold, at least min_len long
+    --
+    output: yields per batch (record, its ORFs, indices of the batch ORFs, their scores, which of them are called)
+    """
+    for record in records:
+        orfs = ORF(record.sequence, mm.long_len, mm.short_len, both_strands)
+        for idxs, scores in score_batches(mm, orfs, batch_size):
+            called = (scores > threshold) & (orfs.lengths[idxs] >= min_len)
+            yield record, orfs, idxs, scores, called
+
+
+class TsvWriter:
+    """ one line per call: seqid, 0-based [start, end) of the ORF without its stop codon, strand, length, score """
+    def __init__(self, f):
+        self.f = f
+        self.f.write("seqid\tstart\tend\tstrand\tlength\tscore\n")
+
+    def write(self, seqid, orfs, idxs, scores):
+        for i, score in zip(idxs, scores):
+            self.f.write("{}\t{}\t{}\t{}\t{}\t{:.6f}\n".format(
+                seqid, orfs.starts[i], orfs.ends[i], "+" if orfs.strands[i] > 0 else "-", orfs.ends[i] - orfs.starts[i], score))
+
+
+class Gff3Writer:
+    """ one CDS feature per call, 1-based inclusive coordinates including the stop codon (as in the gold set annotation) """
+    def __init__(self, f):
+        self.f = f
+        self.f.write("##gff-version 3\n")
+        self.n = 0
+
+    def write(self, seqid, orfs, idxs, scores):
+        L = len(orfs.codes)
+        for i, score in zip(idxs, scores):
+            self.n += 1
+            if orfs.strands[i] > 0:
+                start, end, strand = orfs.starts[i] + 1, min(orfs.ends[i] + 3, L), "+"
+            else:
+                start, end, strand = max(orfs.starts[i] - 2, 1), orfs.ends[i], "-"
+            self.f.write("{}\tmarkovprediction\tCDS\t{}\t{}\t{:.6f}\t{}\t0\tID=orf{};length={}\n".format(
+                seqid, start, end, score, strand, self.n, orfs.ends[i] - orfs.starts[i]))
+
+
+WRITERS = {"gff3": Gff3Writer, "tsv": TsvWriter}
+
+
+def run(mm, fasta, out, fmt="gff3", threshold=0.0, min_len=0, batch_size=10000, both_strands=True):
+    """
+    score every record of a FASTA file and write the calls to an open file as they're made
+    --
+    output: run statistics, including throughput in bases per second -> dict
+    """
+    writer = WRITERS[fmt](out)
+    stats = {"records": 0, "bases": 0, "orfs": 0, "calls": 0}
+    begin = time.perf_counter()
+
+    def counted(records):
+        # records are counted as they're read, so ones without any ORF (i.e. empty or short records) count too
+        for record in records:
+            stats["records"] += 1
+            stats["bases"] += record.seq_len
+            yield record
+
+    for record, orfs, idxs, scores, called in gene_calls(mm, counted(iter_fasta(fasta, encoded=True)), threshold, min_len, batch_size, both_strands):
+        stats["orfs"] += len(idxs)
+        stats["calls"] += int(called.sum())
+        writer.write(record.seq_id, orfs, idxs[called], scores[called])
+
+    stats["seconds"] = time.perf_counter() - begin
+    stats["bases_per_second"] = stats["bases"] / stats["seconds"] if stats["seconds"] > 0 else float("inf")
+    return stats
+
+
+def add_arguments(parser):
+    """ arguments of a scoring run, shared with cli.py """
+    parser.add_argument("model", help="model saved with MarkovModel.save (.npz)")
+    parser.add_argument("fasta", help="genome(s) to score, .fna or .fna.gz")
+    parser.add_argument("-o", "-out", dest="out", default="-", help="output file, - for stdout")
+    parser.add_argument("-format", choices=sorted(WRITERS), default="gff3")
+    parser.add_argument("-threshold", type=float, default=0.0, help="call ORFs scoring above this log likelihood ratio")
+    parser.add_argument("-min_len", type=int, default=0, help="only call ORFs at least this long")
+    parser.add_argument("-batch", type=int, default=10000, help="ORFs scored per batch")
+    parser.add_argument("-forward_only", action="store_true", help="only scan the forward strand")
+
+
+def score(args):
+    """ score every ORF of a FASTA file with a saved model, write the calls and report the run statistics """
+    mm = MarkovModel.load(args.model)
+    out = sys.stdout if args.out == "-" else open(args.out, "w")
+    try:
+        stats = run(mm, args.fasta, out, args.format, args.threshold, args.min_len, args.batch, not args.forward_only)
+    finally:
+        if out is not sys.stdout:
+            out.close()
+
+    print("scored {records} records, {bases} bases, {orfs} ORFs, {calls} calls in {seconds:.2f}s ({bases_per_second:,.0f} bases/s)".format(**stats),
+          file=sys.stderr)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="score every ORF of a FASTA file with a saved markov model, writing calls as GFF3 or TSV")
+    add_arguments(parser)
+    score(parser.parse_args(argv))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,164 @@
+# per-stage profiling of the training / scoring pipeline
+# stages are marked with `with stage("name", bases=n) as s: ...` around the work they time. profiling is off by default,
+# and then stage() returns a shared no-op context manager, so instrumented code pays one function call and nothing else.
+# when enabled, each stage accumulates its calls, wall and CPU time, item counts (bases, ORFs, kmers, ...), the process's
+# peak RSS and, optionally, the peak tracemalloc memory above what was allocated when the stage started.
+
+import json
+import resource
+import sys
+import time
+import tracemalloc
+
+_enabled = False
+_trace_memory = False
+_stages = {}
+_stack = []
+
+
+class _NullStage:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def count(self, **items):
+        pass
+
+
+NULL_STAGE = _NullStage()
+
+
+class _Stage:
+    __slots__ = ("name", "counts", "wall", "cpu", "traced", "peak_before")
+
+    def __init__(self, name, counts):
+        self.name = name
+        self.counts = counts
+        self.peak_before = 0
+
+    def count(self, **items):
+        """ add item counts that are only known inside the stage """
+        for key, value in items.items():
+            self.counts[key] = self.counts.get(key, 0) + value
+
+    def __enter__(self):
+        if _trace_memory:
+            # nested stages reset the tracemalloc peak, so the enclosing stage keeps the peak it had seen so far
+            current, peak = tracemalloc.get_traced_memory()
+            if _stack:
+                _stack[-1].peak_before = max(_stack[-1].peak_before, peak)
+            tracemalloc.reset_peak()
+            self.traced = current
+        _stack.append(self)
+        self.cpu = time.process_time()
+        self.wall = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        wall = time.perf_counter() - self.wall
+        cpu = time.process_time() - self.cpu
+        _stack.pop()
+
+        metrics = _stages.setdefault(self.name, {"calls": 0, "wall_seconds": 0.0, "cpu_seconds": 0.0, "peak_rss_mb": 0.0, "counts": {}})
+        metrics["calls"] += 1
+        metrics["wall_seconds"] += wall
+        metrics["cpu_seconds"] += cpu
+        metrics["peak_rss_mb"] = max(metrics["peak_rss_mb"], peak_rss_mb())
+        for key, value in self.counts.items():
+            metrics["counts"][key] = metrics["counts"].get(key, 0) + int(value)
+
+        if _trace_memory:
+            peak = max(tracemalloc.get_traced_memory()[1], self.peak_before)
+            if _stack:
+                _stack[-1].peak_before = max(_stack[-1].peak_before, peak)
+            metrics["peak_traced_mb"] = max(metrics.get("peak_traced_mb", 0.0), (peak - self.traced) / 1e6)
+        return False
+
+
+def stage(name, **counts):
+    """ context manager timing a pipeline stage, a no-op unless profiling is enabled """
+    if not _enabled:
+        return NULL_STAGE
+    return _Stage(name, counts)
+
+
+def enable(trace_memory=False):
+    """ start collecting stage metrics, with trace_memory also tracemalloc peaks (which slows allocation heavy code down) """
+    global _enabled, _trace_memory
+    _enabled = True
+    _trace_memory = trace_memory
+    if trace_memory and not tracemalloc.is_tracing():
+        tracemalloc.start()
+
+
+def disable():
+    global _enabled, _trace_memory
+    _enabled = False
+    if _trace_memory:
+        tracemalloc.stop()
+    _trace_memory = False
+
+
+def reset():
+    _stages.clear()
+
+
+def peak_rss_mb():
+    """ peak resident set size of the process so far (ru_maxrss is in kB on linux, bytes on macOS) """
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss / 1e6 if sys.platform == "darwin" else rss / 1e3
+
+
+def metrics():
+    """ collected metrics of every stage, in the order the stages first finished -> dict """
+    return {"stages": {name: dict(values, counts=dict(values["counts"])) for name, values in _stages.items()},
+            "peak_rss_mb": peak_rss_mb(), "trace_memory": _trace_memory}
+
+
+def prometheus_text(prefix="markov"):
+    """ stage metrics in the Prometheus text exposition format, i.e. for a node_exporter textfile collector """
+    gauges = [("calls", "number of times the stage ran"), ("wall_seconds", "wall time spent in the stage"),
+              ("cpu_seconds", "CPU time spent in the stage"), ("peak_rss_mb", "peak RSS of the process at the end of the stage"),
+              ("peak_traced_mb", "peak tracemalloc memory allocated within the stage")]
+    lines = []
+    for key, help in gauges:
+        values = [(name, stage[key]) for name, stage in _stages.items() if key in stage]
+        if not values:
+            continue
+        lines.append("# HELP {}_stage_{} {}".format(prefix, key, help))
+        lines.append("# TYPE {}_stage_{} gauge".format(prefix, key))
+        lines += ['{}_stage_{}{{stage="{}"}} {}'.format(prefix, key, name, value) for name, value in values]
+
+    counted = [(name, item, value) for name, stage in _stages.items() for item, value in stage["counts"].items()]
+    if counted:
+        lines.append("# HELP {}_stage_items items processed by the stage".format(prefix))
+        lines.append("# TYPE {}_stage_items counter".format(prefix))
+        lines += ['{}_stage_items{{stage="{}",item="{}"}} {}'.format(prefix, name, item, value) for name, item, value in counted]
+    return "\n".join(lines) + "\n"
+
+
+def report():
+    """ human readable table of the stage metrics """
+    lines = ["{:<16} {:>6} {:>10} {:>10} {:>10} {:>10}  {}".format("stage", "calls", "wall s", "cpu s", "rss MB", "traced MB", "items")]
+    for name, values in _stages.items():
+        items = ", ".join("{}={:,}".format(key, value) for key, value in values["counts"].items())
+        traced = "{:.1f}".format(values["peak_traced_mb"]) if "peak_traced_mb" in values else "-"
+        lines.append("{:<16} {:>6} {:>10.3f} {:>10.3f} {:>10.1f} {:>10}  {}".format(
+            name, values["calls"], values["wall_seconds"], values["cpu_seconds"], values["peak_rss_mb"], traced, items))
+    return "\n".join(lines)
+
+
+def dump(filename):
+    """ write the metrics as Prometheus text if the file ends in .prom, as JSON otherwise, or the report to stderr for - """
+    if filename == "-":
+        print(report(), file=sys.stderr)
+        return
+    with open(filename, "w") as f:
+        if filename.endswith(".prom"):
+            f.write(prometheus_text())
+        else:
+            json.dump(metrics(), f, indent=2)
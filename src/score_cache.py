@@ -0,0 +1,126 @@
+# memoized ORF scores
+# the scores of a set of ORFs only depend on the model's counts and pseudocount (not short_len, not the run) and on
+# the genome and ORF spans they're computed on. so they're cached under a model fingerprint and a digest of the
+# genome and spans, in memory with LRU eviction bounded by total bytes, and optionally on disk so a later run
+# re-evaluating an unchanged configuration loads them instead of rescoring.
+
+import hashlib
+import os
+import threading
+from collections import OrderedDict
+import numpy as np
+from profiling import stage
+
+
+def span_digest(codes, starts, ends, strands=None):
+    """ content hash of a genome and a set of ORF spans on it """
+    h = hashlib.sha256()
+    for array in (codes, starts, ends) + (() if strands is None else (strands,)):
+        array = np.ascontiguousarray(array)
+        h.update(array.dtype.str.encode())
+        h.update(np.int64(len(array)).tobytes())
+        h.update(array.data)
+    return h.hexdigest()
+
+
+class ScoreCache:
+    """ score arrays by (model fingerprint, span digest), least recently used ones evicted beyond max_bytes """
+    def __init__(self, max_bytes=256 * 2**20, directory=None):
+        self.max_bytes = max_bytes
+        self.directory = directory
+        self.entries = OrderedDict()
+        self.bytes = 0
+        self.lock = threading.Lock()
+        self.counters = {"hits": 0, "disk_hits": 0, "misses": 0, "evictions": 0}
+
+    def path(self, key):
+        return os.path.join(self.directory, "{}.npy".format(hashlib.sha256("/".join(key).encode()).hexdigest()[:32]))
+
+    def key(self, mm, spans):
+        """ cache key of a model's scores of the ORF spans with the given span_digest """
+        return (mm.fingerprint(), spans)
+
+    def get(self, key):
+        """ cached scores of a key, from memory or else from disk, None on a miss """
+        with stage("score_cache") as profile:
+            scores, source = self.lookup(key)
+            profile.count(**{source: 1})
+        with self.lock:
+            self.counters[source] += 1
+        return scores
+
+    def lookup(self, key):
+        with self.lock:
+            scores = self.entries.get(key)
+            if scores is not None:
+                self.entries.move_to_end(key)
+                return scores, "hits"
+
+        if self.directory is not None and os.path.exists(self.path(key)):
+            scores = np.load(self.path(key))
+            self.put(key, scores, persist=False)
+            return scores, "disk_hits"
+        return None, "misses"
+
+    def put(self, key, scores, persist=True):
+        """ cache scores under a key and return the cached array, a copy if scores is a view (i.e. a matrix column) """
+        scores = np.asarray(scores)
+        if scores.base is not None:
+            # a view would keep its whole base array alive, uncounted by nbytes
+            scores = scores.copy()
+        scores.flags.writeable = False
+        with self.lock:
+            if key in self.entries:
+                self.bytes -= self.entries.pop(key).nbytes
+            if scores.nbytes <= self.max_bytes:
+                self.entries[key] = scores
+                self.bytes += scores.nbytes
+            while self.bytes > self.max_bytes:
+                _, evicted = self.entries.popitem(last=False)
+                self.bytes -= evicted.nbytes
+                self.counters["evictions"] += 1
+
+        if persist and self.directory is not None:
+            os.makedirs(self.directory, exist_ok=True)
+            path = self.path(key)
+            np.save(path + ".tmp.npy", scores)
+            os.replace(path + ".tmp.npy", path)
+        return scores
+
+    def scores(self, mm, codes, starts, ends, compute, strands=None):
+        """
+        scores of ORF spans under a model, computed with compute() only if they aren't cached
+        --
+        input: model -> MarkovModel, genome buffer and spans -> np.ndarray x3, scoring function -> callable
+        output: read only scores -> np.ndarray
+        """
+        key = self.key(mm, span_digest(codes, starts, ends, strands))
+        scores = self.get(key)
+        if scores is None:
+            scores = self.put(key, compute())
+        return scores
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.bytes = 0
+
+    def stats(self):
+        with self.lock:
+            return dict(self.counters, entries=len(self.entries), bytes=self.bytes, max_bytes=self.max_bytes, directory=self.directory)
+
+    def __repr__(self):
+        return "ScoreCache({})".format(", ".join("{}={}".format(key, value) for key, value in self.stats().items()))
+
+
+# shared by every model in the process
+SCORE_CACHE = ScoreCache()
+
+
+def configure(max_bytes=None, directory=None):
+    """ resize the shared cache and/or persist it under a directory """
+    if max_bytes is not None:
+        SCORE_CACHE.max_bytes = max_bytes
+    if directory is not None:
+        SCORE_CACHE.directory = directory
+    return SCORE_CACHE
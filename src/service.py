@@ -0,0 +1,290 @@
+# local scoring service: trained models stay loaded, and concurrent requests are scored together
+#   python src/service.py -model mj=model.npz -port 8765            (or -unix /tmp/markov.sock)
+# the protocol is JSON lines over TCP (localhost) or a unix socket, one request per line and one response per line:
+#   {"id": 1, "sequence": "ATG...", "name": "q1"}                         -> ORF calls of one sequence
+#   {"id": 2, "fasta": ">a\nATG...\n>b\n...", "model": "mj", "threshold": 5, "min_len": 90, "both_strands": false}
+#   {"id": 3, "sequence": "ATG...", "orfs": false}                         -> score of the whole sequence
+#   {"op": "models"} / {"op": "stats"}
+# responses carry the request id and come back as soon as their batch is scored, not necessarily in request order.
+# each model admits at most max_pending requests at a time (backpressure: while it's full, no more lines are read from
+# the client's connection, so a flooding client is slowed down by its own socket). queued requests are taken off in
+# batches of up to max_batch requests arriving within the batch window. each batch is scored with one vectorized
+# score_ranges over all of its records, in a worker thread so the event loop keeps serving I/O.
+
+import argparse
+import asyncio
+import json
+import os
+import sys
+import numpy as np
+from MarkovModel import MarkovModel
+from ORF import ORF
+from encoding import INVALID
+from fasta import NORMALIZE, WHITESPACE, iter_records, make_record
+
+# a JSON line can hold a whole genome
+LINE_LIMIT = 2**28
+
+
+class Request:
+    """ a parsed scoring request: its records as (name, base codes) and the calling options """
+    __slots__ = ("id", "records", "orfs", "threshold", "min_len", "both_strands")
+
+    def __init__(self, message):
+        self.id = message.get("id")
+        for key in ("fasta", "sequence", "name"):
+            if key in message and not isinstance(message[key], str):
+                raise ValueError("{} must be a string".format(key))
+        if "fasta" in message:
+            self.records = [(record.seq_id, record.sequence) for record in
+                            iter_records(message["fasta"].encode().splitlines(keepends=True), True, "request {}".format(self.id))]
+        elif "sequence" in message:
+            sequence = bytearray(message["sequence"].encode().translate(NORMALIZE, WHITESPACE))
+            self.records = [(message.get("name", "sequence"), make_record(None, sequence, True).sequence)]
+        else:
+            raise ValueError("a request needs a sequence or a fasta payload")
+        self.orfs = bool(message.get("orfs", True))
+        self.threshold = float(message.get("threshold", -np.inf))
+        self.min_len = int(message.get("min_len", 0))
+        self.both_strands = bool(message.get("both_strands", True))
+
+
+def score_requests(mm, requests):
+    """
+    score a batch of requests at once: the ranges of every record (its ORFs, or the whole record) are put in one
+    buffer, separated by an invalid base, and scored in one score_ranges call
+    --
+    output: response of each request -> list of dict
+    """
+    buffers, starts, ends, parts = [], [], [], []
+    offset = 0
+    for request in requests:
+        for name, codes in request.records:
+            if request.orfs:
+                orfs = ORF(codes, mm.long_len, mm.short_len, request.both_strands)
+                buffer, s, e = orfs.buffer_ranges()
+            else:
+                orfs, buffer, s, e = None, codes, np.array([0]), np.array([len(codes)])
+            buffers += [buffer, np.array([INVALID], dtype=np.uint8)]
+            starts.append(s + offset)
+            ends.append(e + offset)
+            parts.append((request, name, orfs, len(s), len(codes)))
+            offset += len(buffer) + 1
+
+    scores = mm.score_ranges(np.concatenate(buffers), np.concatenate(starts), np.concatenate(ends)) if parts else np.zeros(0)
+
+    responses = {id(request): {"id": request.id, "records": []} for request in requests}
+    i = 0
+    for request, name, orfs, n, length in parts:
+        record_scores = scores[i:i+n]
+        i += n
+        if orfs is None:
+            responses[id(request)]["records"].append({"name": name, "length": length, "score": float(record_scores[0])})
+            continue
+        called = np.flatnonzero((record_scores > request.threshold) & (orfs.lengths >= request.min_len))
+        calls = [{"start": int(orfs.starts[j]), "end": int(orfs.ends[j]), "strand": "+" if orfs.strands[j] > 0 else "-",
+                  "length": int(orfs.ends[j] - orfs.starts[j]), "score": float(record_scores[j])} for j in called]
+        responses[id(request)]["records"].append({"name": name, "orfs": n, "calls": calls})
+    return [responses[id(request)] for request in requests]
+
+
+class Batcher:
+    """ request queue of one model, with at most max_pending requests in flight, drained in batches of requests that arrive within the batch window """
+    def __init__(self, mm, window=0.005, max_batch=64, max_pending=1024):
+        self.mm = mm
+        self.window = window
+        self.max_batch = max_batch
+        self.queue = asyncio.Queue()
+        self.slots = asyncio.Semaphore(max_pending)
+        self.stats = {"requests": 0, "batches": 0, "records": 0}
+
+    async def submit(self, request):
+        """ queue a request and wait for its response """
+        future = asyncio.get_running_loop().create_future()
+        self.queue.put_nowait((request, future))
+        return await future
+
+    async def run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self.queue.get()]
+            deadline = loop.time() + self.window
+            while len(batch) < self.max_batch:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self.queue.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+
+            requests = [request for request, _ in batch]
+            try:
+                responses = await loop.run_in_executor(None, score_requests, self.mm, requests)
+            except Exception as e:
+                responses = [{"id": request.id, "error": str(e)} for request in requests]
+            for (_, future), response in zip(batch, responses):
+                if not future.done():
+                    future.set_result(response)
+
+            self.stats["requests"] += len(batch)
+            self.stats["batches"] += 1
+            self.stats["records"] += sum(len(request.records) for request in requests)
+
+
+class ScoringService:
+    """ models kept in memory by name, each with its own batcher; the first model is the default """
+    def __init__(self, models, window=0.005, max_batch=64, max_pending=1024):
+        self.batchers = {name: Batcher(mm, window, max_batch, max_pending) for name, mm in models.items()}
+        self.default = next(iter(models))
+        self.tasks = []
+
+    def start(self):
+        self.tasks = [asyncio.ensure_future(batcher.run()) for batcher in self.batchers.values()]
+
+    def stop(self):
+        for task in self.tasks:
+            task.cancel()
+
+    async def handle(self, message):
+        """ response to one decoded request """
+        op = message.get("op", "score")
+        if op == "models":
+            return {"id": message.get("id"), "models": {name: {"k": b.mm.k, "pseudocount": b.mm.pseudocount, "long_len": b.mm.long_len}
+                                                        for name, b in self.batchers.items()}}
+        if op == "stats":
+            return {"id": message.get("id"), "stats": {name: dict(b.stats, pending=b.queue.qsize()) for name, b in self.batchers.items()}}
+        if op != "score":
+            return {"id": message.get("id"), "error": "unknown op {}".format(op)}
+
+        name = message.get("model", self.default)
+        if not isinstance(name, str) or name not in self.batchers:
+            return {"id": message.get("id"), "error": "unknown model {}".format(name)}
+        try:
+            request = Request(message)
+        except (ValueError, TypeError) as e:
+            return {"id": message.get("id"), "error": str(e)}
+        return await self.batchers[name].submit(request)
+
+    async def connection(self, reader, writer):
+        """ serve one client: every request line is handled concurrently, responses are written as they're ready """
+        lock = asyncio.Lock()
+        pending = set()
+
+        async def respond(message, batcher):
+            # every request gets a response line, or its client would wait for it forever
+            try:
+                response = await self.handle(message)
+            except Exception as e:
+                response = {"id": message.get("id"), "error": "{}: {}".format(type(e).__name__, e)}
+            finally:
+                if batcher is not None:
+                    batcher.slots.release()
+            async with lock:
+                writer.write((json.dumps(response) + "\n").encode())
+                await writer.drain()
+
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                if not line.strip():
+                    continue
+                try:
+                    message = json.loads(line)
+                except ValueError as e:
+                    message = None
+                    error = {"error": "invalid JSON: {}".format(e)}
+                if not isinstance(message, dict):
+                    async with lock:
+                        writer.write((json.dumps(error if message is None else {"error": "a request is a JSON object"}) + "\n").encode())
+                        await writer.drain()
+                    continue
+                # wait for a free slot of the model before reading on
+                name = message.get("model", self.default)
+                batcher = self.batchers.get(name) if isinstance(name, str) and message.get("op", "score") == "score" else None
+                if batcher is not None:
+                    await batcher.slots.acquire()
+                task = asyncio.ensure_future(respond(message, batcher))
+                pending.add(task)
+                task.add_done_callback(pending.discard)
+            if pending:
+                await asyncio.gather(*pending)
+        finally:
+            writer.close()
+
+    async def serve(self, host="127.0.0.1", port=8765, unix=None, ready=None):
+        """ serve until cancelled, on a unix socket if given, else on host:port (port 0 picks a free one) """
+        self.start()
+        if unix:
+            server = await asyncio.start_unix_server(self.connection, unix, limit=LINE_LIMIT)
+        else:
+            server = await asyncio.start_server(self.connection, host, port, limit=LINE_LIMIT)
+        if ready is not None:
+            ready(server)
+        try:
+            async with server:
+                await server.serve_forever()
+        finally:
+            self.stop()
+
+
+async def request(messages, host="127.0.0.1", port=8765, unix=None):
+    """ client: send requests over one connection and return their responses, in request order (by id) """
+    if unix:
+        reader, writer = await asyncio.open_unix_connection(unix, limit=LINE_LIMIT)
+    else:
+        reader, writer = await asyncio.open_connection(host, port, limit=LINE_LIMIT)
+    messages = [dict(message, id=message.get("id", i)) for i, message in enumerate(messages)]
+    for message in messages:
+        writer.write((json.dumps(message) + "\n").encode())
+    await writer.drain()
+
+    responses = {}
+    while len(responses) < len(messages):
+        line = await reader.readline()
+        if not line:
+            break
+        response = json.loads(line)
+        responses[response.get("id")] = response
+    writer.close()
+    await writer.wait_closed()
+    return [responses.get(message["id"]) for message in messages]
+
+
+def load_models(specs):
+    """ models from name=path.npz specs, a bare path is named after its file """
+    models = {}
+    for spec in specs:
+        name, _, path = spec.rpartition("=")
+        name = name or os.path.splitext(os.path.basename(path))[0]
+        models[name] = MarkovModel.load(path)
+    return models
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="local scoring service: JSON lines requests scored by models kept in memory")
+    parser.add_argument("-model", action="append", required=True, help="name=path of a saved model (.npz), can be repeated")
+    parser.add_argument("-host", default="127.0.0.1")
+    parser.add_argument("-port", type=int, default=8765, help="TCP port, 0 picks a free one")
+    parser.add_argument("-unix", help="serve on this unix socket path instead of TCP")
+    parser.add_argument("-window", type=float, default=5.0, help="batch window in milliseconds")
+    parser.add_argument("-max_batch", type=int, default=64, help="most requests scored in one batch")
+    parser.add_argument("-max_pending", type=int, default=1024, help="requests per model in flight before clients are slowed down")
+    args = parser.parse_args(argv)
+
+    service = ScoringService(load_models(args.model), args.window / 1000, args.max_batch, args.max_pending)
+
+    def ready(server):
+        where = ", ".join(str(socket.getsockname()) for socket in server.sockets)
+        print("serving {} on {}".format(", ".join(service.batchers), where), file=sys.stderr, flush=True)
+
+    try:
+        asyncio.run(service.serve(args.host, args.port, args.unix, ready))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,157 @@
+# incremental parameter sweeps of the markov model over one genome
+# ORFs are parsed once and kmers are counted once, at the largest k. then:
+#   - smaller k tables are derived by marginalization (see kmers.count_orders)
+#   - long_len only decides which orfs are in the training set, so the training counts of each long_len are
+#     the counts of the next larger long_len plus the counts of the orfs in between
+#   - pseudocount only changes the normalization, so it's just a rebuild of the log probability tables
+#   - short_len doesn't affect training or scoring at all, so its configurations share scores
+#   - the orders of a (pseudocount, long_len) configuration are scored together in one pass (see multiorder.py)
+#   - scores are also kept in the shared score cache (see score_cache.py), so other sweeps of the genome reuse them
+
+import numpy as np
+from MarkovModel import MarkovModel
+from ORF import ORF
+from evaluation import roc_auc
+from kmers import count_orders, count_starts, ranges_table_class
+from multiorder import MultiOrderModel
+from score_cache import SCORE_CACHE, span_digest
+from training import TrainingCounts
+
+DEFAULTS = {"k": 5, "pseudocount": 1, "long_len": 1400, "short_len": 50}
+
+
+def add_orders(counts, other):
+    """ add two count tables keyed by k, None is an empty table """
+    if counts is None:
+        return other
+    return {k: counts[k] + other[k] for k in counts}
+
+
+class Sweep:
+    def __init__(self, seq, max_k=7, long_lens=(1400,), short_len=50, both_strands=False):
+        self.max_k = max_k
+        self.long_lens = sorted(set(long_lens), reverse=True)
+
+        # orfs are parsed once, the candidate training orfs are the ones longer than the smallest long_len
+        self.orfs = ORF(seq, self.long_lens[-1], short_len, both_strands)
+        # the long and background ranges point into the orfs' buffers, which aren't kept here so the genome is held once
+        _, self.long_starts, self.long_ends = self.orfs.long_ranges()
+        self.long_lengths = self.long_ends - self.long_starts
+        _, self.bg_starts, self.bg_ends = self.orfs.background_ranges()
+
+        self.counts = self.count_long_lens()
+        self._scores = {}
+        self._spans = None
+
+    @property
+    def codes(self):
+        """ buffer of the long orf ranges """
+        return self.orfs.buffer
+
+    @property
+    def bg_codes(self):
+        """ buffer of the background ranges, i.e. both strands """
+        return self.orfs.strand_codes()
+
+    def count_long_lens(self, selected=None):
+        """
+        training counts of each long_len, built up from the largest long_len down by adding orfs
+        --
+        input: only count these candidate training orfs (optional) -> np.ndarray of bool, one per long orf
+        output: (long orf, background) counts keyed by k, keyed by long_len -> dict of tuple
+        """
+        candidates = np.ones(len(self.long_lengths), dtype=bool) if selected is None else selected
+        table = ranges_table_class(self.max_k, self.long_starts[candidates], self.long_ends[candidates])
+        counts = {}
+        P, Q = None, None
+        previous = np.inf
+        for long_len in self.long_lens:
+            added = (self.long_lengths > long_len) & (self.long_lengths <= previous) & candidates
+            P = add_orders(P, count_orders(self.codes, self.long_starts[added], self.long_ends[added], self.max_k, table=table))
+            Q = add_orders(Q, count_orders(self.bg_codes, self.bg_starts[added], self.bg_ends[added], self.max_k, table=table))
+            counts[long_len] = (P, Q)
+            previous = long_len
+        return counts
+
+    def training_counts(self, k, long_len, counts=None, selected=None):
+        """ count tables of a configuration, from the shared counts or from counts of selected orfs by count_long_lens -> TrainingCounts """
+        if k > self.max_k:
+            raise ValueError("k = {} is larger than the sweep's max_k = {}".format(k, self.max_k))
+        if long_len not in self.counts:
+            raise ValueError("long_len = {} is not one of the sweep's long_lens {}".format(long_len, self.long_lens))
+
+        P, Q = (self.counts if counts is None else counts)[long_len]
+        training = self.long_lengths > long_len
+        if selected is not None:
+            training &= selected
+        tables = {
+            "kmer_counts": P[k], "kponemer_counts": P[k+1],
+            "start_counts": count_starts(self.codes, self.long_starts[training], self.long_ends[training], k, type(P[k+1])),
+            "bg_kmer_counts": Q[k], "bg_kponemer_counts": Q[k+1],
+            "bg_start_counts": count_starts(self.bg_codes, self.bg_starts[training], self.bg_ends[training], k, type(P[k+1])),
+        }
+        return TrainingCounts(k, long_len, tables, [], self.orfs.both_strands)
+
+    def model(self, k, pseudocount, long_len):
+        """ markov model of a configuration, built from the shared counts without touching the genome """
+        counts = self.training_counts(k, long_len)
+        return MarkovModel.from_counts(k, pseudocount, counts.tables, self.orfs, long_len, self.orfs.short_len, both_strands=self.orfs.both_strands)
+
+    def spans(self):
+        """ digest of the genome and ORF spans, part of the score cache key """
+        if self._spans is None:
+            self._spans = span_digest(self.orfs.codes, self.orfs.starts, self.orfs.ends, self.orfs.strands)
+        return self._spans
+
+    def scores(self, k=5, pseudocount=1, long_len=1400):
+        """ scores of every ORF under a configuration, computed once per configuration """
+        key = (k, pseudocount, long_len)
+        if key not in self._scores:
+            self._scores[key] = self.model(k, pseudocount, long_len).orf_scores()
+        return self._scores[key]
+
+    def multi_order(self, ks, pseudocount=1, long_len=1400, weights=None):
+        """ models of several orders scored in a single pass, optionally mixed with the given weights per order """
+        return MultiOrderModel([self.model(k, pseudocount, long_len) for k in ks], weights, self.orfs)
+
+    def order_scores(self, ks, pseudocount=1, long_len=1400):
+        """ scores of every ORF under each of the orders ks, computed together and memoized like scores() """
+        missing = {}
+        for k in sorted(set(ks)):
+            if (k, pseudocount, long_len) in self._scores:
+                continue
+            mm = self.model(k, pseudocount, long_len)
+            key = SCORE_CACHE.key(mm, self.spans())
+            scores = SCORE_CACHE.get(key)
+            if scores is None:
+                missing[k] = (mm, key)
+            else:
+                self._scores[(k, pseudocount, long_len)] = scores
+
+        if missing:
+            scores = MultiOrderModel([mm for mm, _ in missing.values()], orfs=self.orfs).scores()
+            for i, (k, (mm, key)) in enumerate(missing.items()):
+                self._scores[(k, pseudocount, long_len)] = SCORE_CACHE.put(key, scores[:, i])
+        return np.column_stack([self._scores[(k, pseudocount, long_len)] for k in ks])
+
+    def run(self, configs, labels):
+        """
+        AUC of every configuration
+        --
+        input: configurations, missing parameters take DEFAULTS -> list of dict, gold set match of every ORF -> np.ndarray of bool
+        output: one row per configuration with its parameters and AUC -> pd.DataFrame
+        """
+        import pandas as pd
+
+        configs = [dict(DEFAULTS, **config) for config in configs]
+        orders = {}
+        for config in configs:
+            orders.setdefault((config["pseudocount"], config["long_len"]), []).append(config["k"])
+        for (pseudocount, long_len), ks in orders.items():
+            self.order_scores(ks, pseudocount, long_len)
+
+        rows = []
+        for config in configs:
+            scores = self.scores(config["k"], config["pseudocount"], config["long_len"])
+            rows.append(dict(config, auc=roc_auc(labels, scores)))
+        return pd.DataFrame(rows, columns=list(DEFAULTS) + ["auc"])
@@ -4,146 +4,135 @@
 #   2. process data into ORFs using ORF class
 #   3. run model training using MarkovModel class
 #   4. generate relevant plots
+# each step is a function, so they can be reused from cli.py or a notebook without running the whole script.
+# pandas and matplotlib are only imported by the steps that use them.
 
 import argparse
 import numpy as np
-from statistics import median
-from sklearn.metrics import roc_curve
-from sklearn.metrics import roc_auc_score
-from sklearn.metrics import accuracy_score
-import matplotlib.pyplot as plt
-from MarkovModel import MarkovModel
-from ORF import ORF, read_fna
-import pandas as pd
-
-parser = argparse.ArgumentParser()
-parser.add_argument("-longl", type=int, action="store")
-parser.add_argument("-shortl", type=int, action="store")
-parser.add_argument("-k", type=int, action="store")
-parser.add_argument("-pseudo", type=float, action="store")
-parser.add_argument("-r", type=float, action="store")
-args = parser.parse_args()
-
-if args.longl:
-    longl = args.longl
-else:
-    longl = 1400
-
-if args.shortl:
-    shortl = args.shortl
-else:
-    shortl = 50
-
-if args.k:
-    k = args.k
-else:
-    k = 5
-
-if args.pseudo:
-    pseudo = args.pseudo
-else:
-    pseudo = 1
-
-if args.r:
-    r = args.r
-else:
-    r = 0.2
-
-# input data
-data=read_fna("data/GCF_000091665.1_ASM9166v1_genomic.fna")
-seq = data[0].sequence
-
-# golden set (out dev set)
-goldens = pd.read_csv("data/plusgenes-subset.gff", delimiter="\t", header=None)
-
-# markov model
-mm = MarkovModel(k, pseudo, seq, longl, shortl)
-results = mm.results()
-df_results = pd.DataFrame(results)
-
-# organize results into df
-results = mm.results()
-
-# check matches function
-def check_match(end_idx):
-    stop_idx = end_idx + 3
-    matches = goldens.index[goldens[4] == stop_idx]
-    if len(matches) == 0:
-        return False
-    else:
-        return True
-
-df_results["matches"] = df_results["end"].apply(lambda x: check_match(int(x)))
-
-def find_nearest(array, value):
-    array = np.asarray(array)
-    idx = (np.abs(array - value)).argmin()
-    return idx
-
-def idx_nearest_match(df_results, col, thresholds):
-    accuracies = []
-
-    for t in thresholds:
-        acc= accuracy_score(col > t, df_results["matches"])
-        accuracies.append(acc)
-    
-    return find_nearest(accuracies, 0.8)
-
-# report things! below generates a quick orf start, end positions by reading frames. this serves as a quick sanity check too.
-print(mm.orfs)
-print("\nreading frame 3\n", "total number: ", len(mm.orfs.idxs0), "\n", \
-    " first: ", mm.orfs.idxs0[0], " (length of {})".format(len(mm.orfs.orf0[0])), "\n", \
-    " last: ", mm.orfs.idxs0[-1], " (length of {})".format(len(mm.orfs.orf0[-1])), "\n")
-print("reading frame 1\n", "total number: ", len(mm.orfs.idxs1), "\n", \
-    " first: ", mm.orfs.idxs1[0], " (length of {})".format(len(mm.orfs.orf1[0])), "\n", \
-    " last: ", mm.orfs.idxs1[-1], " (length of {})".format(len(mm.orfs.orf1[-1])), "\n")
-print("reading frame 2\n", "total number: ", len(mm.orfs.idxs2), "\n", \
-    " first: ", mm.orfs.idxs2[0], " (length of {})".format(len(mm.orfs.orf2[0])), "\n", \
-    " last: ", mm.orfs.idxs2[-1], " (length of {})".format(len(mm.orfs.orf2[-1])), "\n")
-print("total number of CDS strands: ", len(goldens[0]))
-
-long = df_results[df_results["length"] > longl]
-short = df_results[df_results["length"] < shortl]
-
-print("shortest orfs: ")
-print(short.sort_values("start")[:5])
-print("longest orfs: ")
-print(long.sort_values("start")[:5])
+from MarkovModel import cached_model
+from genome_cache import read_genome
+from gff import read_gold_set
+from evaluation import Evaluation, combined_scores, flashbulb_line
+from training import count_records, genome_records
+import profiling
+import score_cache
+from profiling import stage
+
+FNA = "data/GCF_000091665.1_ASM9166v1_genomic.fna"
+GFF = "data/GCF_000091665.1_ASM9166v1_genomic.gff"
+DEFAULTS = {"longl": 1400, "shortl": 50, "k": 5, "pseudo": 1, "r": 0.2}
+
+
+def add_model_arguments(parser):
+    """ arguments that select the genome and the model trained on it, shared with cli.py """
+    parser.add_argument("-fna", default=FNA, help="genome FASTA file, the first record is scored")
+    parser.add_argument("-longl", type=int, action="store")
+    parser.add_argument("-shortl", type=int, action="store")
+    parser.add_argument("-k", type=int, action="store")
+    parser.add_argument("-pseudo", type=float, action="store")
+    parser.add_argument("-all_records", action="store_true", help="train on every record of the FASTA file (i.e. the plasmids too), not just the first")
+    parser.add_argument("-extra_fna", nargs="*", default=[], help="more FASTA files to add to the training set")
+    parser.add_argument("-both_strands", action="store_true", help="find ORFs in all six reading frames, not just the forward strand")
+    parser.add_argument("-processes", type=int, action="store", help="size of the counting process pool, defaults to all cores")
+    parser.add_argument("-score_processes", type=int, default=1, help="size of the ORF scoring process pool, 1 scores in process")
+    parser.add_argument("-models", default="models", help="trained model cache directory")
+    parser.add_argument("-score_cache", metavar="DIR", help="also keep ORF scores on disk in this directory, so unchanged configurations aren't rescored")
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser()
+    add_model_arguments(parser)
+    parser.add_argument("-r", type=float, action="store")
+    parser.add_argument("-gff", default=GFF, help="GFF3 annotation the gold set is read from")
+    parser.add_argument("-output", default="output", help="directory the plots are written to")
+    parser.add_argument("-profile", "--profile", nargs="?", const="-",
+                        help="time every pipeline stage, and print a report (no value) or dump the metrics to a .json or .prom (Prometheus textfile) file")
+    parser.add_argument("-profile_memory", action="store_true", help="with -profile, also trace the peak memory of every stage (slower)")
+    return with_defaults(parser.parse_args(argv))
+
+
+def with_defaults(args):
+    """ fill in the model parameters that weren't given """
+    for name, value in DEFAULTS.items():
+        if not getattr(args, name, None):
+            setattr(args, name, value)
+    return args
+
+
+def load_model(args, data):
+    """
+    markov model, loaded from the model cache if this genome and parameters were trained before.
+    with more records or genomes, every record is counted in a process pool and the counts are merged into one model
+    """
+    seq = data[0].sequence
+    if args.all_records or args.extra_fna:
+        records = genome_records([args.fna] + args.extra_fna) if args.all_records else [seq] + genome_records(args.extra_fna)
+        return count_records(records, args.k, args.longl, args.processes, args.both_strands).model(args.pseudo, seq, args.shortl)
+    return cached_model(args.k, args.pseudo, seq, args.longl, args.shortl, args.models, args.both_strands)
+
+
+def score_genome(mm, goldens, processes=1):
+    """ every ORF of the model's genome with its score, and whether its stop codon is a gold set gene's stop codon -> pd.DataFrame """
+    import pandas as pd
+
+    # organize results into df
+    df_results = pd.DataFrame(mm.results(processes=processes))
+
+    # label matches: an ORF matches if its stop codon is a gold set gene's stop codon
+    df_results["matches"], df_results["gene"] = goldens.label(mm.orfs.ends, mm.orfs.starts, mm.orfs.strands)
+    return df_results
+
+
+def report(mm, df_results, goldens, longl, shortl):
+    # report things! below generates a quick orf start, end positions by reading frames. this serves as a quick sanity check too.
+    print(mm.orfs)
+    print("\nreading frame 3\n", "total number: ", len(mm.orfs.idxs0), "\n", \
+        " first: ", mm.orfs.idxs0[0], " (length of {})".format(len(mm.orfs.orf0[0])), "\n", \
+        " last: ", mm.orfs.idxs0[-1], " (length of {})".format(len(mm.orfs.orf0[-1])), "\n")
+    print("reading frame 1\n", "total number: ", len(mm.orfs.idxs1), "\n", \
+        " first: ", mm.orfs.idxs1[0], " (length of {})".format(len(mm.orfs.orf1[0])), "\n", \
+        " last: ", mm.orfs.idxs1[-1], " (length of {})".format(len(mm.orfs.orf1[-1])), "\n")
+    print("reading frame 2\n", "total number: ", len(mm.orfs.idxs2), "\n", \
+        " first: ", mm.orfs.idxs2[0], " (length of {})".format(len(mm.orfs.orf2[0])), "\n", \
+        " last: ", mm.orfs.idxs2[-1], " (length of {})".format(len(mm.orfs.orf2[-1])), "\n")
+    print("total number of CDS strands: ", len(goldens))
+
+    long = df_results[df_results["length"] > longl]
+    short = df_results[df_results["length"] < shortl]
+
+    print("shortest orfs: ")
+    print(short.sort_values("start")[:5])
+    print("longest orfs: ")
+    print(long.sort_values("start")[:5])
 
 
 # plot things! the output of the functions below are shown in the pdf.
 def roc_len_score(fig, df_results, combined_results):
-    """ plot the ROC curves. then, using ROC metrics and lengths, label the models at thresholds """
-    
-    fpr, tpr, thresholds = roc_curve(df_results["matches"], df_results["score"])
-    auc = roc_auc_score(df_results["matches"], df_results["score"])
-    fpr_len, tpr_len, thresholds_len = roc_curve(df_results["matches"], df_results["length"])
-    auc_len = roc_auc_score(df_results["matches"], df_results["length"])
-    fpr_combined, tpr_combined, thresholds_combined = roc_curve(df_results["matches"], combined_results)
-    auc_combined = roc_auc_score(df_results["matches"], combined_results)
-
-
-    idx_score = idx_nearest_match(df_results, df_results["score"], thresholds)
-    idx_len = idx_nearest_match(df_results, df_results["length"], thresholds_len)
-    idx_combined = idx_nearest_match(df_results, combined_results, thresholds_combined)
-
-
-    plt.plot(fpr, tpr, "g-", label="score, auc = {}".format(auc))
-    plt.plot(fpr[idx_score], tpr[idx_score], "go", label="threshold at {}".format(thresholds[idx_score]))
-    plt.plot(fpr_len, tpr_len, "r-", label="length, auc = {}".format(auc_len))
-    plt.plot(fpr_len[idx_len], tpr_len[idx_len], "r*", label="threshold at {}".format(thresholds_len[idx_len]))
-    plt.plot(fpr_combined, tpr_combined, "b-", label="combined/flashbulb, auc = {}".format(auc_combined))
-    plt.plot(fpr_combined[idx_combined], tpr_combined[idx_combined], "b*", label="threshold at {}".format(thresholds_combined[idx_combined]))
+    """ plot the ROC curves. then, using ROC metrics and lengths, label the models at thresholds nearest to 0.8 accuracy """
+    import matplotlib.pyplot as plt
+
+    curves = [(df_results["score"], "g", "o", "score"),
+              (df_results["length"], "r", "*", "length"),
+              (combined_results, "b", "*", "combined/flashbulb")]
+
+    for scores, color, marker, name in curves:
+        ev = Evaluation(df_results["matches"], scores, target=0.8)
+        plt.plot(*ev.curve(), color+"-", label="{}, auc = {}".format(name, ev.auc))
+        plt.plot(*ev.point(), color+marker, label="threshold at {}".format(ev.threshold))
     plt.xlabel("False Positive Rate")
     plt.ylabel("True Positive Rate")
     plt.title("ROC curves of Length and Markov Scores")
     plt.legend()
 
 def zoomin(fig, xlow, xhigh, ylow, yhigh):
+    import matplotlib.pyplot as plt
+
     plt.xlim(xlow,xhigh)
     plt.ylim(ylow,yhigh)
 
 def scatter_len_score(fig, df_results):
+    import matplotlib.pyplot as plt
+
     cmap = ["royalblue" if c else "firebrick" for c in df_results["matches"]]
     plt.scatter(df_results["length"],df_results["score"],c=cmap, s=5)
     plt.xlabel("Length")
@@ -152,39 +141,28 @@ def scatter_len_score(fig, df_results):
 
 # this "flashbulb method" was a rough approximate method to combine length and markov model score for gene prediction
 # essentially identifies decision boundary plane of two features.
-def flashbulb(fig, df_results,r):
+def flashbulb(fig, df_results, r, longl=1400, shortl=50):
     """
     given the plot of length vs. markov score, we first plot a line of short ORF median to long ORF median.
     then, a bisection of these two medians at a perpendicular line becomes our decision boundary: protein or no protein
-    
+
     --
     input: fig to overlay on, output of scored ORFs in a dataframe format, r=parameters of bisection
     output: return the perpendicular line (m = slope -> float, y_intercept -> float)
-    
+
     """
+    import matplotlib.pyplot as plt
+
     long = df_results[df_results["length"] > longl]
     short = df_results[df_results["length"] < shortl]
-    (Sx,Sy) = median(short["length"]),median(short["score"])
-    (Lx,Ly)=median(long["length"]), median(long["score"])
-
-    #calculate a line through the medians:
-    m=(Ly-Sy)/(Lx-Sx)
-    b=Ly-m*Lx
-
-    #calculate perpendicular lines, i.e. thresholding boundary:
-    xcross = Sx + r*(Lx - Sx)
-    #print(xcross)
-    #print(Lx,Ly)
-    #print(Sx,Sy)
-    #print(longl)
-    ycross = m*xcross+b
-    y_intercept = ycross - (1/m)*xcross
+    m, y_intercept, (Sx,Sy), (Lx,Ly) = flashbulb_line(df_results["length"], df_results["score"], longl, shortl, r)
+    b = Ly-m*Lx
 
     # plot
     scatter_len_score(fig, long)
     scatter_len_score(fig, short)
-    plt.plot(median(short["length"]),median(short["score"]),"r*", 30)
-    plt.plot(median(long["length"]), median(long["score"]),"b*", 30)
+    plt.plot(Sx,Sy,"r*", 30)
+    plt.plot(Lx,Ly,"b*", 30)
 
     ax = plt.axes()
     x = np.linspace(-100,8000,1000)
@@ -196,30 +174,49 @@ def flashbulb(fig, df_results,r):
     return m, y_intercept
 
 
-fig = plt.figure()
-m, y_intercept = flashbulb(fig, df_results, r)
-plt.savefig("output/decision_bdy.png")
-plt.close()
+def plot(df_results, k, pseudo, longl, shortl, r, output="output"):
+    """ decision boundary and ROC curves (full and zoomed in) of the scored ORFs, written to the output directory """
+    import matplotlib.pyplot as plt
+
+    with stage("plot"):
+        fig = plt.figure()
+        m, y_intercept = flashbulb(fig, df_results, r, longl, shortl)
+        plt.savefig("{}/decision_bdy.png".format(output))
+        plt.close()
+
+
+    combined_results = combined_scores(df_results["length"], df_results["score"], m, y_intercept)
+    with stage("plot"):
+        fig = plt.figure()
+        roc_len_score(fig, df_results, combined_results)
+        plt.savefig("{}/roc_curve_k{}_pseudo{}_longl{}_shortl{}.png".format(output, k, pseudo, longl, shortl))
+        zoomin(fig, -0.02, 0.15, 0.75, 1.03)
+        plt.savefig("{}/roc_curve_k{}_pseudo{}_longl{}_shortl{}_zoomed.png".format(output, k, pseudo, longl, shortl))
+        plt.close()
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    if args.profile:
+        profiling.enable(args.profile_memory)
+    score_cache.configure(directory=args.score_cache)
 
+    # input data, read through the packed genome cache (data/*.fna.pack) after the first run
+    data = read_genome(args.fna)
 
-def combine_mm_len(df_results, m, y_intercept):
-    """ combine markov model score and length features and come up with 'final score' """
-    y_pred = []
+    # golden set (our dev set): plus strand (or both strands) CDS of the chromosome, indexed by stop codon
+    goldens = read_gold_set(args.gff, data[0].seq_id, None if args.both_strands else "+")
 
-    for row in df_results.iterrows():
-        x = row[1]["length"]
+    mm = load_model(args, data)
+    df_results = score_genome(mm, goldens, args.score_processes)
+    report(mm, df_results, goldens, args.longl, args.shortl)
+    plot(df_results, args.k, args.pseudo, args.longl, args.shortl, args.r, args.output)
 
-        temp = (-1/m)*x-y_intercept
-        y_pred.append(row[1]["score"]-temp)
+    print(mm) # this will call repr method, which was formatted to print ORF kmer counts in markov model
 
-    return y_pred
+    if args.profile:
+        profiling.dump(args.profile)
 
-combined_results = combine_mm_len(df_results, m, y_intercept)
-fig = plt.figure()
-roc_len_score(fig, df_results, combined_results)
-plt.savefig("output/roc_curve_k{}_pseudo{}_longl{}_shortl{}.png".format(k, pseudo, longl, shortl))
-zoomin(fig, -0.02, 0.15, 0.75, 1.03)
-plt.savefig("output/roc_curve_k{}_pseudo{}_longl{}_shortl{}_zoomed.png".format(k, pseudo, longl, shortl))
-plt.close()
 
-print(mm) # this will call repr method, which was formatted to print ORF kmer counts in markov model 
+if __name__ == "__main__":
+    main()
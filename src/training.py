@@ -0,0 +1,121 @@
+# training the markov model over many records and genomes
+# every record (contig, plasmid, genome) is parsed into ORFs and counted on its own, in a process pool.
+# count tables are plain additive arrays, so the per record counts are merged by summing (map-reduce)
+# and normalized once into a single model. the same merge adds new genomes to an already trained model.
+
+import hashlib
+from concurrent.futures import ProcessPoolExecutor
+from functools import reduce
+from MarkovModel import COUNT_TABLES, MarkovModel
+from ORF import ORF
+from encoding import digest
+from genome_cache import PackedGenome, load_genome
+from kmers import count_kmer_pair, count_starts, ranges_table_class
+
+
+class TrainingCounts:
+    """ count tables of a training set, i.e. everything a MarkovModel is normalized from, and the genomes they came from """
+    def __init__(self, k, long_len, tables, digests, both_strands=False):
+        self.k = k
+        self.long_len = long_len
+        self.tables = tables
+        self.digests = digests
+        self.both_strands = both_strands
+
+    @classmethod
+    def from_orfs(cls, orfs, k):
+        """ count the long orfs of a parsed genome record and their background """
+        long_codes, long_starts, long_ends = orfs.long_ranges()
+        bg_codes, bg_starts, bg_ends = orfs.background_ranges()
+
+        table = ranges_table_class(k, long_starts, long_ends)
+        tables = {}
+        tables["kmer_counts"], tables["kponemer_counts"] = count_kmer_pair(long_codes, long_starts, long_ends, k, table)
+        tables["start_counts"] = count_starts(long_codes, long_starts, long_ends, k, table)
+        tables["bg_kmer_counts"], tables["bg_kponemer_counts"] = count_kmer_pair(bg_codes, bg_starts, bg_ends, k, table)
+        tables["bg_start_counts"] = count_starts(bg_codes, bg_starts, bg_ends, k, table)
+        return cls(k, orfs.long_len, tables, [digest(orfs.codes)], orfs.both_strands)
+
+    @classmethod
+    def from_model(cls, mm):
+        """ the counts a model was trained from """
+        digests = [mm.genome_digest] if mm.genome_digest else []
+        return cls(mm.k, mm.long_len, {name: getattr(mm, name) for name in COUNT_TABLES}, digests, mm.both_strands)
+
+    def check_compatible(self, other):
+        if (self.k, self.long_len, self.both_strands) != (other.k, other.long_len, other.both_strands):
+            raise ValueError("can't merge counts of k={}, long_len={}, both_strands={} with counts of k={}, long_len={}, both_strands={}".format(
+                self.k, self.long_len, self.both_strands, other.k, other.long_len, other.both_strands))
+
+    def __add__(self, other):
+        self.check_compatible(other)
+        tables = {name: self.tables[name] + other.tables[name] for name in COUNT_TABLES}
+        return TrainingCounts(self.k, self.long_len, tables, self.digests + other.digests, self.both_strands)
+
+    def __sub__(self, other):
+        self.check_compatible(other)
+        tables = {name: self.tables[name] - other.tables[name] for name in COUNT_TABLES}
+        return TrainingCounts(self.k, self.long_len, tables, [x for x in self.digests if x not in other.digests], self.both_strands)
+
+    def genome_digest(self):
+        """ content hash of the training genomes, the record hash itself if there's only one """
+        if len(self.digests) == 1:
+            return self.digests[0]
+        return hashlib.sha256("".join(self.digests).encode()).hexdigest()
+
+    def model(self, pseudocount, seq=None, short_len=50):
+        """ normalize the counts into a markov model, optionally setting the genome to score """
+        return MarkovModel.from_counts(self.k, pseudocount, self.tables, seq, self.long_len, short_len, self.genome_digest(), self.both_strands)
+
+    def __repr__(self):
+        return "TrainingCounts(k={}, long_len={}, records={}, long orf kmers={})".format(
+            self.k, self.long_len, len(self.digests), self.tables["kmer_counts"].total())
+
+
+def count_record(task):
+    """
+    worker: count one record. a task is (k, long_len, both_strands, record), where the record is a sequence or a
+    (packed genome cache path, record index) pair, so that workers map the genome instead of receiving it pickled
+    """
+    k, long_len, both_strands, record = task
+    if isinstance(record, tuple):
+        path, i = record
+        record = PackedGenome(path)[i]
+    return TrainingCounts.from_orfs(ORF(record, long_len, both_strands=both_strands), k)
+
+
+def count_records(records, k, long_len=1400, processes=None, both_strands=False):
+    """
+    count every record in a process pool and merge the counts
+    --
+    input: sequences or (packed genome path, record index) pairs -> list, k -> int, long_len -> int, pool size (None = all cores, 1 = no pool) -> int
+    output: merged counts -> TrainingCounts
+    """
+    tasks = [(k, long_len, both_strands, record) for record in records]
+    if processes == 1 or len(tasks) == 1:
+        counts = map(count_record, tasks)
+        return reduce(lambda x, y: x + y, counts)
+
+    with ProcessPoolExecutor(processes) as pool:
+        counts = pool.map(count_record, tasks)
+        return reduce(lambda x, y: x + y, counts)
+
+
+def genome_records(filenames):
+    """ (packed genome path, record index) tasks of every record in a list of FASTA files, packing them if needed """
+    records = []
+    for filename in filenames:
+        genome = load_genome(filename)
+        records += [(genome.path, i) for i in range(len(genome))]
+    return records
+
+
+def train(filenames, k, pseudocount, long_len=1400, short_len=50, processes=None, seq=None, both_strands=False):
+    """ train a single markov model on every record of every given FASTA file """
+    return count_records(genome_records(filenames), k, long_len, processes, both_strands).model(pseudocount, seq, short_len)
+
+
+def update_model(mm, filenames, processes=None):
+    """ add the counts of more genomes to a trained model, without recounting what it was trained on """
+    counts = TrainingCounts.from_model(mm) + count_records(genome_records(filenames), mm.k, mm.long_len, processes, mm.both_strands)
+    return counts.model(mm.pseudocount, mm.orfs, mm.short_len)
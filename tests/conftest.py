@@ -0,0 +1,5 @@
+# the modules in src/ import each other as top level modules, like the scripts do when run as python src/X.py
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "src"))
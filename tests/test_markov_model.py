@@ -0,0 +1,37 @@
+import numpy as np
+from MarkovModel import COUNT_TABLES, MarkovModel
+from kmers import KmerCounts, SparseKmerCounts, table_class
+
+
+def random_genome(n, seed=0):
+    return "".join(np.random.default_rng(seed).choice(list("ACGT"), n))
+
+
+def test_save_load_k_between_strand_backends(tmp_path):
+    # at k=9 a 300k genome used to count the forward strand sparse and the two strand buffer dense
+    seq = random_genome(300_000)
+    k = 9
+    assert table_class(k+1, len(seq)) is not table_class(k+1, 2*len(seq))
+
+    mm = MarkovModel(k, 1, seq, long_len=200, short_len=50)
+    assert len({type(getattr(mm, name)) for name in COUNT_TABLES}) == 1
+
+    mm.save(tmp_path / "model.npz")
+    loaded = MarkovModel.load(tmp_path / "model.npz", seq)
+    for name in COUNT_TABLES:
+        assert getattr(loaded, name) == getattr(mm, name)
+    assert np.array_equal(loaded.orf_scores(cache=None), mm.orf_scores(cache=None))
+
+
+def test_save_load_mixed_tables(tmp_path):
+    seq = random_genome(50_000, seed=1)
+    mm = MarkovModel(4, 1, seq, long_len=200)
+    counts = {name: getattr(mm, name) for name in COUNT_TABLES}
+    counts["kponemer_counts"] = counts["kponemer_counts"].sparse()
+    mixed = MarkovModel.from_counts(4, 1, counts, seq, long_len=200)
+    assert isinstance(mixed.kponemer_counts, SparseKmerCounts) and not isinstance(mixed.kmer_counts, SparseKmerCounts)
+    assert isinstance(mixed.kmer_counts, KmerCounts)
+
+    mixed.save(tmp_path / "mixed.npz")
+    loaded = MarkovModel.load(tmp_path / "mixed.npz", seq)
+    np.testing.assert_allclose(loaded.orf_scores(cache=None), mm.orf_scores(cache=None))
@@ -0,0 +1,42 @@
+import numpy as np
+from MarkovModel import MarkovModel
+from encoding import encode, kmer_code
+from multiorder import MultiOrderModel
+
+
+def random_sequence(n, rng):
+    return "".join(rng.choice(list("ACGT"), n))
+
+
+def models(ks, seed=0):
+    seq = random_sequence(30_000, np.random.default_rng(seed))
+    return [MarkovModel(k, 1, seq, long_len=200) for k in ks]
+
+
+def test_scores_match_each_order():
+    mms = models([2, 3, 5])
+    seq = random_sequence(2000, np.random.default_rng(1))
+    codes, starts, ends = encode(seq), np.array([0, 100, 1500]), np.array([900, 1200, 2000])
+    scores = MultiOrderModel(mms).scores(codes, starts, ends)
+    for i, mm in enumerate(mms):
+        np.testing.assert_allclose(scores[:, i], mm.score_ranges(codes, starts, ends), atol=1e-9)
+
+
+def test_mixture_by_hand():
+    # every order predicts the same base: the last base of the largest order's k+1mer
+    low, high = models([2, 4])
+    weights = [0.3, 0.7]
+    seq = "ACGTTGCAAGTCCAGGTACATTGACCATG"
+    start, end = 2, 25
+
+    def mix(log_tables, kmers):
+        return np.log(sum(w * np.exp(table[kmer_code(kmer)]) for w, table, kmer in zip(weights, log_tables, kmers)))
+
+    expected = mix([low.log_p_start, high.log_p_start], [seq[start:start+2], seq[start:start+4]]) - \
+        mix([low.log_q_start, high.log_q_start], [seq[start:start+2], seq[start:start+4]])
+    for i in range(start + 1, end - 4):
+        kmers = [seq[i+2:i+5], seq[i:i+5]]
+        expected += mix([low.log_p, high.log_p], kmers) - mix([low.log_q, high.log_q], kmers)
+
+    mixture = MultiOrderModel([low, high], weights).mixture_scores(encode(seq), np.array([start]), np.array([end]))
+    np.testing.assert_allclose(mixture[0], expected)
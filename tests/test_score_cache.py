@@ -0,0 +1,47 @@
+import numpy as np
+from MarkovModel import MarkovModel, model_key
+from score_cache import ScoreCache
+
+
+class Model:
+    def fingerprint(self):
+        return "model"
+
+
+def test_hits_and_misses():
+    cache = ScoreCache()
+    calls = []
+
+    def compute():
+        calls.append(1)
+        return np.array([1.0, 2.0])
+
+    codes, starts, ends = np.zeros(10, dtype=np.uint8), np.array([0, 3]), np.array([3, 9])
+    first = cache.scores(Model(), codes, starts, ends, compute)
+    again = cache.scores(Model(), codes, starts, ends, compute)
+    assert len(calls) == 1
+    assert (cache.stats()["misses"], cache.stats()["hits"]) == (1, 1)
+    assert np.array_equal(first, again)
+
+
+def test_columns_are_stored_as_copies():
+    matrix = np.ones((1000, 5))
+    cache = ScoreCache(max_bytes=2 * matrix[:, 0].nbytes)
+    for i in range(5):
+        stored = cache.put(("m{}".format(i), "s"), matrix[:, i])
+        assert stored.base is None and stored.nbytes == 8000
+    stats = cache.stats()
+    assert stats["entries"] == 2 and stats["bytes"] == 16000 and stats["evictions"] == 3
+
+
+def test_disk_persistence(tmp_path):
+    ScoreCache(directory=str(tmp_path)).put(("m", "s"), np.arange(4.0))
+    cache = ScoreCache(directory=str(tmp_path))
+    assert np.array_equal(cache.get(("m", "s")), np.arange(4.0))
+    assert cache.stats()["disk_hits"] == 1
+
+
+def test_fingerprint_ignores_number_type():
+    seq = "".join(np.random.default_rng(0).choice(list("ACGT"), 20_000))
+    assert MarkovModel(3, 1, seq, long_len=200).fingerprint() == MarkovModel(3, 1.0, seq, long_len=200).fingerprint()
+    assert model_key(5, 1, 1400, "genome") == model_key(5, 1.0, 1400, "genome")
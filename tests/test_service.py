@@ -0,0 +1,56 @@
+import asyncio
+import numpy as np
+from MarkovModel import MarkovModel
+from ORF import ORF
+from encoding import encode
+from service import ScoringService, request
+
+
+def random_sequence(n, rng):
+    return "".join(rng.choice(list("ACGT"), n))
+
+
+def serve_and_request(models, messages, **options):
+    """ start the service on a free localhost port, send the messages over one connection and stop it """
+    async def main():
+        ready = asyncio.get_running_loop().create_future()
+        service = ScoringService(models, **options)
+        server = asyncio.ensure_future(service.serve("127.0.0.1", 0, ready=lambda s: ready.set_result(s.sockets[0].getsockname()[1])))
+        port = await asyncio.wait_for(ready, 10)
+        try:
+            return await asyncio.wait_for(request(messages, port=port), 30), service
+        finally:
+            server.cancel()
+    return asyncio.run(main())
+
+
+def test_batched_scores_match_score_ranges():
+    rng = np.random.default_rng(0)
+    mm = MarkovModel(3, 1, random_sequence(30_000, rng), long_len=200)
+    sequences = [random_sequence(int(n), rng) for n in rng.integers(300, 3000, 40)]
+    messages = [{"sequence": seq, "name": "q{}".format(i)} for i, seq in enumerate(sequences)]
+    messages.append({"sequence": sequences[0], "orfs": False})
+
+    responses, service = serve_and_request({"mm": mm}, messages, window=0.05)
+    assert service.batchers["mm"].stats["batches"] < len(messages)
+
+    for seq, response in zip(sequences, responses):
+        orfs = ORF(encode(seq), mm.long_len, mm.short_len, True)
+        expected = mm.score_ranges(*orfs.buffer_ranges())
+        record = response["records"][0]
+        assert record["orfs"] == len(expected)
+        np.testing.assert_allclose([call["score"] for call in record["calls"]], expected)
+    codes = encode(sequences[0])
+    np.testing.assert_allclose(responses[-1]["records"][0]["score"], mm.score_ranges(codes, [0], [len(codes)])[0])
+
+
+def test_malformed_requests_get_errors():
+    rng = np.random.default_rng(1)
+    mm = MarkovModel(3, 1, random_sequence(10_000, rng), long_len=200)
+    messages = [{"sequence": 5}, {"fasta": ["ACGT"]}, {"sequence": "ACGT", "model": ["mm"]},
+                {"sequence": "ACGT", "model": "other"}, {"sequence": "ACGT", "threshold": "high"},
+                {"sequence": "ATGAAATAG"}]
+    responses, _ = serve_and_request({"mm": mm}, messages)
+    assert all("error" in response for response in responses[:-1])
+    assert [response["id"] for response in responses] == list(range(len(messages)))
+    assert "records" in responses[-1]